@@ -0,0 +1,83 @@
+import argparse
+import asyncio
+import logging
+import sys
+
+import gi
+
+gi.require_version("DBus", "1.0")
+gi.require_version("Gtk", "4.0")
+
+# Requires PyGObject>=3.50
+from gi.events import GLibEventLoopPolicy  # noqa: E402
+from gi.repository import Gtk  # type: ignore  # noqa: E402
+
+from speedoflight.services.agent import AgentService  # noqa: E402
+from speedoflight.services.batch import BatchService  # noqa: E402
+from speedoflight.services.batch.batch_service import (  # noqa: E402
+    DEFAULT_POLL_INTERVAL,
+)
+from speedoflight.services.configuration import ConfigurationService  # noqa: E402
+from speedoflight.services.desktop import DesktopService  # noqa: E402
+from speedoflight.services.history import HistoryService  # noqa: E402
+from speedoflight.services.ledger import LedgerService  # noqa: E402
+from speedoflight.services.llm.llm_service import LlmService  # noqa: E402
+from speedoflight.services.mcp import McpService  # noqa: E402
+
+# How long to wait for the MCP servers to list their tools.
+MCP_TIMEOUT = 60.0  # seconds
+
+
+async def main(args: argparse.Namespace) -> int:
+    with open(args.prompts, encoding="utf-8") as f:
+        prompts = [line.strip() for line in f if line.strip()]
+
+    # Same services as the app, minus the UI
+    configuration = ConfigurationService()
+    desktop = DesktopService(configuration=configuration)
+    llm = LlmService(configuration=configuration, desktop=desktop)
+    mcp = McpService(configuration=configuration)
+    history = HistoryService()
+    agent = AgentService(
+        configuration=configuration,
+        desktop=desktop,
+        llm=llm,
+        history=history,
+        mcp=mcp,
+        ledger=LedgerService(history=history),
+    )
+    batch = BatchService(
+        configuration=configuration,
+        llm=llm,
+        agent=agent,
+        poll_interval=args.poll_interval,
+    )
+
+    await mcp.wait_for_servers(MCP_TIMEOUT)
+    results = await batch.run(prompts)
+    for result in results:
+        print(result.model_dump_json())
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run prompts (one per line) with the Message Batches API."
+    )
+    parser.add_argument("prompts", help="Path to the prompts file.")
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=DEFAULT_POLL_INTERVAL,
+        help="Seconds between batch status checks.",
+    )
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    Gtk.init()  # The desktop service needs a display
+
+    # Integrates PyGObject with Python's asyncio, which also runs the GLib
+    # main loop that signals are delivered through.
+    asyncio.set_event_loop_policy(GLibEventLoopPolicy())
+    sys.exit(asyncio.run(main(args)))
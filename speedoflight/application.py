@@ -9,13 +9,14 @@ gi.require_version("Gtk", "4.0")
 gi.require_version("GtkSource", "5")
 
 
-from gi.repository import Adw, Gio  # type: ignore  # noqa: E402
+from gi.repository import Adw, Gio, GLib  # type: ignore  # noqa: E402
 
 from speedoflight.constants import APPLICATION_ID, LOG_FILE  # noqa: E402
 from speedoflight.services.agent import AgentService  # noqa: E402
 from speedoflight.services.configuration import ConfigurationService  # noqa: E402
 from speedoflight.services.desktop import DesktopService  # noqa: E402
 from speedoflight.services.history import HistoryService  # noqa: E402
+from speedoflight.services.ledger import LedgerService  # noqa: E402
 from speedoflight.services.llm.llm_service import LlmService  # noqa: E402
 from speedoflight.services.mcp import McpService  # noqa: E402
 from speedoflight.services.orchestrator import OrchestratorService  # noqa: E402
@@ -32,8 +33,22 @@ class SolApplication(Adw.Application):
 
         self._setup_logging()
         self._logger = logging.getLogger(__name__)
+        self._resume_session_id: str | None = None
+        self.add_main_option(
+            "resume",
+            ord("r"),
+            GLib.OptionFlags.NONE,
+            GLib.OptionArg.STRING,
+            "Restore a session, to resume a run that was interrupted",
+            "SESSION_ID",
+        )
         self._logger.info("Initialized.")
 
+    def do_handle_local_options(self, options: GLib.VariantDict) -> int:
+        if options.contains("resume"):
+            self._resume_session_id = options.lookup_value("resume").get_string()
+        return -1  # Continue with the default processing
+
     def _setup_logging(self):
         """Setup logging to both console and file."""
         root_logger = logging.getLogger()
@@ -79,6 +94,7 @@ class SolApplication(Adw.Application):
         self._desktop = DesktopService(configuration=self._configuration)
         self._llm = LlmService(configuration=self._configuration, desktop=self._desktop)
         self._history = HistoryService()
+        self._ledger = LedgerService(history=self._history)
         self._mcp = McpService(configuration=self._configuration)
         self._agent = AgentService(
             configuration=self._configuration,
@@ -86,12 +102,15 @@ class SolApplication(Adw.Application):
             llm=self._llm,
             history=self._history,
             mcp=self._mcp,
+            ledger=self._ledger,
         )
 
         self._orchestrator = OrchestratorService(
             configuration=self._configuration,
             agent=self._agent,
         )
+        if self._resume_session_id:
+            self._orchestrator.restore_session(self._resume_session_id)
 
         # View models
         self._main_view_model = MainViewModel(orchestrator=self._orchestrator)
@@ -114,7 +133,9 @@ class SolApplication(Adw.Application):
         self._main_view_model.shutdown()
         self._orchestrator.shutdown()
         self._agent.shutdown()
+        self._llm.shutdown()
         self._history.shutdown()
+        self._ledger.shutdown()
         self._mcp.shutdown()
         self._desktop.shutdown()
         self._configuration.shutdown()
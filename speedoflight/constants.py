@@ -9,12 +9,19 @@ DEFAULT_MARGIN = 10
 
 # Agent Service Signals
 AGENT_UPDATE_AI_SIGNAL = "agent-update-ai"
+AGENT_UPDATE_AI_DELTA_SIGNAL = "agent-update-ai-delta"
+AGENT_DISCARD_AI_SIGNAL = "agent-discard-ai"
 AGENT_UPDATE_TOOL_SIGNAL = "agent-update-tool"
 AGENT_UPDATE_SOL_SIGNAL = "agent-update-sol"
+AGENT_UPDATE_STATUS_SIGNAL = "agent-update-status"
+AGENT_UPDATE_USAGE_SIGNAL = "agent-update-usage"
 AGENT_READY_SIGNAL = "agent-ready"
 AGENT_RUN_STARTED_SIGNAL = "agent-run-started"
 AGENT_RUN_COMPLETED_SIGNAL = "agent-run-completed"
 
+# LLM Service Signals
+LLM_STATUS_SIGNAL = "llm-status"
+
 # MCP Service Signals
 SERVER_INITIALIZED_SIGNAL = "server-initialized"
 
@@ -17,9 +17,26 @@ class LLMProvider(Enum):
     ANTHROPIC = "anthropic"
 
 
+class ThinkingMode(Enum):
+    OFF = "off"
+    FIXED = "fixed"  # Think on every iteration
+    ADAPTIVE = "adaptive"  # Budget per step, none on routine tool follow-ups
+
+
+class Pricing(BaseModel):
+    # USD per million tokens
+    input: float = 0.0
+    output: float = 0.0
+    cache_read: float = 0.0
+    cache_write: float = 0.0
+
+
 class BaseLLMConfig(BaseModel):
     temperature: float = 0.25
     model: str
+    enable_streaming: bool = True
+    thinking_mode: ThinkingMode = ThinkingMode.ADAPTIVE
+    pricing: Pricing = Pricing()  # free, e.g. local models
 
 
 class OllamaConfig(BaseLLMConfig):
@@ -36,6 +53,13 @@ class OllamaConfig(BaseLLMConfig):
     # "llama3.2:latest",  # 2.0 GB
     model: str = "mistral-small:latest"
     host: str = "http://localhost:11434"
+    # Maximum `num_ctx`, which is otherwise sized to fit the conversation
+    context_window: int = 32768  # tokens
+
+    # Load the model at startup, and keep it loaded between messages. A
+    # negative keep alive keeps it loaded until Ollama stops.
+    preload_model: bool = True
+    keep_alive: int = 1800  # seconds
 
 
 class AnthropicConfig(BaseLLMConfig):
@@ -44,9 +68,118 @@ class AnthropicConfig(BaseLLMConfig):
     # E.g. "claude-sonnet-4-0" or "claude-opus-4-0"
     model: str = "claude-sonnet-4-0"
     max_tokens: int = 8192
+    thinking_budget: int = 1024  # tokens, the minimum is 1024
+    context_window: int = 200000  # tokens
     api_key: str
     enable_web_search: bool = False
     enable_computer_use: bool = False
+    enable_prompt_caching: bool = True
+
+    # Claude Sonnet 4, adjust for other models
+    pricing: Pricing = Pricing(input=3.0, output=15.0, cache_read=0.3, cache_write=3.75)
+
+    # E.g. to point the client at a local stand-in server for testing
+    base_url: Optional[str] = None
+
+
+class RetryConfig(BaseModel):
+    # Transient LLM errors (e.g. overloaded, rate limited, connection reset)
+    # are retried with exponential backoff until the deadline is reached.
+    deadline: float = 120.0  # seconds
+    initial_delay: float = 1.0  # seconds
+    max_delay: float = 30.0  # seconds
+
+
+class RoutingConfig(BaseModel):
+    # Providers to switch to, in order, when a request to `llm` fails. Each
+    # one needs its own section under `llms`.
+    fallbacks: list[LLMProvider] = []
+
+    # Also send the request to the first fallback when `llm` has not started
+    # answering after this delay, and keep whichever answers first.
+    hedge_delay: Optional[float] = None  # seconds, disabled by default
+
+
+class CascadeConfig(BaseModel):
+    # Mechanical follow-ups (e.g. a screenshot after a click) go to this
+    # provider, and model if set, the configured `llm` handles the rest.
+    provider: Optional[LLMProvider] = None  # disabled by default
+    model: Optional[str] = None  # e.g. "claude-3-5-haiku-latest"
+    pricing: Optional[Pricing] = None  # required for another paid model
+
+    # Only follow-ups on these tools, all of them when empty
+    routine_tools: list[str] = []
+
+    # Then the configured `llm` takes the next iteration
+    max_routine_iterations: int = 5
+
+
+class CompactionConfig(BaseModel):
+    # Summarize the older messages once a request reaches this many input
+    # tokens, in the background. The history on disk keeps the originals.
+    threshold: Optional[int] = None  # disabled by default
+
+    # The configured `llm` by default, a cheaper model is enough
+    provider: Optional[LLMProvider] = None
+    model: Optional[str] = None
+    pricing: Optional[Pricing] = None  # required for another paid model
+
+    # The most recent messages are always sent as they are
+    keep_messages: int = 6
+
+
+class ToolSearchConfig(BaseModel):
+    # Only send the MCP tools most relevant to the request, when there are
+    # more than this. Desktop tools and tools already used are always sent.
+    max_tools: Optional[int] = None  # disabled by default
+
+    # Also rank the tools with Ollama embeddings, e.g. "nomic-embed-text"
+    embedding_model: Optional[str] = None
+    embedding_host: str = "http://localhost:11434"
+
+
+class CassetteMode(Enum):
+    RECORD = "record"  # Call the LLM and save its responses
+    REPLAY = "replay"  # Serve the saved responses instead of calling the LLM
+
+
+class CassetteConfig(BaseModel):
+    path: str  # JSON Lines file
+    mode: CassetteMode = CassetteMode.REPLAY
+    latency: Optional[float] = None  # seconds, the recorded latency by default
+
+
+class ImageEviction(Enum):
+    PLACEHOLDER = "placeholder"  # Replace the image with a short text
+    THUMBNAIL = "thumbnail"  # Replace the image with a low resolution copy
+
+
+class ContextConfig(BaseModel):
+    # Only the most recent images (e.g. screenshots) are sent at full
+    # resolution, the history on disk keeps all of them.
+    max_images: int = 3
+    image_eviction: ImageEviction = ImageEviction.PLACEHOLDER
+    thumbnail_width: int = 320  # pixels
+
+
+class ScreenshotConfig(BaseModel):
+    # Take a screenshot in the background after each action that changes the
+    # desktop, once it had time to settle, for the next `screenshot` action.
+    prefetch: bool = True
+    settle_delay: float = 1.0  # seconds
+    max_age: float = 10.0  # seconds, taken again when older
+
+
+class HttpConfig(BaseModel):
+    # Connection pool shared by the LLM clients, idle connections are kept
+    # open between agent iterations to skip the TCP and TLS setup.
+    max_connections: int = 10
+    max_keepalive_connections: int = 5
+    keepalive_expiry: float = 300.0  # seconds
+    timeout: float = 600.0  # seconds
+    connect_timeout: float = 5.0  # seconds
+    enable_http2: bool = False  # requires httpx[http2]
+    prewarm: bool = True  # connect to the provider at startup
 
 
 class BaseMCPConfig(BaseModel):
@@ -79,6 +212,15 @@ class AppConfig(BaseModel):
     llms: Optional[dict[str, LLMConfig]] = None
     mcps: Optional[dict[str, MCPConfig]] = None
     max_iterations: int = 25
+    retry: RetryConfig = RetryConfig()
+    routing: RoutingConfig = RoutingConfig()
+    cascade: CascadeConfig = CascadeConfig()
+    compaction: CompactionConfig = CompactionConfig()
+    http: HttpConfig = HttpConfig()
+    context: ContextConfig = ContextConfig()
+    screenshot: ScreenshotConfig = ScreenshotConfig()
+    tool_search: ToolSearchConfig = ToolSearchConfig()
+    cassette: Optional[CassetteConfig] = None
 
     # E.g. "DP-6". Default monitor to use for screenshots in a multi-monitor setup.
     # If not set, the first monitor found will be used.
@@ -193,6 +335,8 @@ class StopReason(Enum):
 class Usage(BaseModel):
     input_tokens: Optional[int] = None
     output_tokens: Optional[int] = None
+    cache_read_tokens: Optional[int] = None
+    cache_write_tokens: Optional[int] = None
 
 
 class BaseMessage(BaseModel):
@@ -233,6 +377,15 @@ class ResponseMessage(BaseMessage):
     usage: Optional[Usage] = None
     stop_reason: Optional[StopReason] = None
     stop_sequence: Optional[str] = None
+    latency: Optional[float] = None  # seconds
+    time_to_first_byte: Optional[float] = None  # seconds, when streamed
+    cost: Optional[float] = None  # USD
+    # Input tokens of the request, including the cached ones (estimated when
+    # the provider leaves them out). Only used while running, not stored.
+    context_tokens: Optional[int] = Field(default=None, exclude=True)
+    # The cheaper model's answer it replaced (see the cascade), which was
+    # paid for as well. Also not stored.
+    escalated_from: Optional["ResponseMessage"] = Field(default=None, exclude=True)
     content: list[
         Annotated[
             Union[
@@ -247,6 +400,28 @@ class ResponseMessage(BaseMessage):
     ]
 
 
+class DeltaType(Enum):
+    TEXT = "text"
+    THINKING = "thinking"
+    TOOL_INPUT = "tool_input"
+    TOOL_INPUT_END = "tool_input_end"  # The input of a local tool is complete
+    RESET = "reset"  # Discard the partial content, the request is retried
+
+
+class ResponseDelta(BaseModel):
+    """Represents an incremental update to a ResponseMessage that is still
+    being generated (streamed) by the LLM. The message ID matches the ID of
+    the final ResponseMessage, and the index identifies the content block."""
+
+    message_id: str
+    index: int
+    type: DeltaType
+    text: str = ""
+    name: Optional[str] = None
+    call_id: Optional[str] = None
+    arguments: Optional[dict] = None
+
+
 class GBaseMessage(GObject.Object):
     def __init__(self, data: BaseMessage):
         super().__init__()
@@ -258,6 +433,37 @@ class GBaseMessage(GObject.Object):
 #
 
 
+class UsageSummary(BaseModel):
+    calls: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_tokens: int = 0
+    cache_write_tokens: int = 0
+    latency: float = 0.0  # seconds
+    cost: float = 0.0  # USD
+
+
+class LlmCall(BaseModel):
+    """One entry of the usage ledger, for each generated message."""
+
+    message_id: str
+    run_id: str
+    created_at: datetime = Field(default_factory=get_now_utc)
+    provider: Optional[str] = None
+    model: Optional[str] = None
+    usage: Usage
+    latency: Optional[float] = None  # seconds
+    time_to_first_byte: Optional[float] = None  # seconds, when streamed
+    cost: float = 0.0  # USD
+
+
+class UsageUpdate(BaseModel):
+    call: LlmCall
+    run: UsageSummary
+    session: UsageSummary
+    rate_limits: Optional[str] = None  # e.g. "40% of input tokens left"
+
+
 class AgentRequest(BaseModel):
     session_id: str
     message: RequestMessage
@@ -266,6 +472,43 @@ class AgentRequest(BaseModel):
 class AgentResponse(BaseModel):
     is_error: bool
     message: Optional[SolMessage] = None
+    resumable: bool = False  # the run stopped before it was done
+    is_cancelled: bool = False  # stopped by the user
+
+
+class AgentStep(Enum):
+    AWAITING_LLM = "awaiting_llm"  # The next message is generated
+    EXECUTING_TOOLS = "executing_tools"  # The tools of the last message run
+    DONE = "done"
+
+
+class AgentCheckpoint(BaseModel):
+    """The step of the agent loop that comes next, stored in the session
+    directory after every transition so that a run can be resumed."""
+
+    step: AgentStep
+    iterations: int = 0
+    message_id: Optional[str] = None  # whose tools are executed
+    error: Optional[str] = None  # why the run stopped, if it did
+    updated_at: datetime = Field(default_factory=get_now_utc)
+
+
+class BatchJobStatus(Enum):
+    PENDING = "pending"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+class BatchJobResult(BaseModel):
+    """Outcome of one of the prompts of a batch run."""
+
+    session_id: str
+    prompt: str
+    status: BatchJobStatus
+    batch_id: Optional[str] = None  # The last batch it was submitted in
+    iterations: int
+    text: Optional[str] = None  # The final answer, when completed
+    error: Optional[str] = None
 
 
 #
@@ -1,3 +1,6 @@
+import asyncio
+from typing import Optional
+
 from gi.repository import GObject  # type: ignore
 from mcp import types
 
@@ -5,29 +8,46 @@ from speedoflight.constants import (
     AGENT_READY_SIGNAL,
     AGENT_RUN_COMPLETED_SIGNAL,
     AGENT_RUN_STARTED_SIGNAL,
+    AGENT_UPDATE_AI_DELTA_SIGNAL,
     AGENT_UPDATE_AI_SIGNAL,
+    AGENT_UPDATE_STATUS_SIGNAL,
     AGENT_UPDATE_TOOL_SIGNAL,
+    AGENT_UPDATE_USAGE_SIGNAL,
+    LLM_STATUS_SIGNAL,
 )
 from speedoflight.models import (
+    AgentCheckpoint,
     AgentRequest,
     AgentResponse,
+    AgentStep,
     BaseMessage,
+    DeltaType,
     ImageMimeType,
     MessageRole,
     RequestMessage,
+    ResponseDelta,
     ResponseMessage,
     SolMessage,
     StopReason,
+    ToolEnvironment,
     ToolImageOutputRequest,
     ToolInputResponse,
     ToolTextOutputRequest,
 )
+from speedoflight.services.agent.history_compactor import HistoryCompactor
+from speedoflight.services.agent.tool_catalog import ToolCatalog
+from speedoflight.services.agent.tool_runner import ToolRunner
+from speedoflight.services.agent.tool_selector import ToolSelector
 from speedoflight.services.base_service import BaseService
 from speedoflight.services.configuration import ConfigurationService
 from speedoflight.services.desktop import DesktopService
 from speedoflight.services.history import HistoryService
+from speedoflight.services.ledger import LedgerService
 from speedoflight.services.llm.llm_service import LlmService
 from speedoflight.services.mcp.mcp_service import McpService
+from speedoflight.utils import get_now_utc
+
+CHECKPOINT_FILE = "agent.json"  # The next step of the agent loop
 
 
 class AgentService(BaseService):
@@ -36,7 +56,10 @@ class AgentService(BaseService):
         AGENT_RUN_STARTED_SIGNAL: (GObject.SignalFlags.RUN_FIRST, None, ()),
         AGENT_RUN_COMPLETED_SIGNAL: (GObject.SignalFlags.RUN_FIRST, None, (str,)),
         AGENT_UPDATE_AI_SIGNAL: (GObject.SignalFlags.RUN_FIRST, None, (str,)),
+        AGENT_UPDATE_AI_DELTA_SIGNAL: (GObject.SignalFlags.RUN_FIRST, None, (str,)),
         AGENT_UPDATE_TOOL_SIGNAL: (GObject.SignalFlags.RUN_FIRST, None, (str,)),
+        AGENT_UPDATE_STATUS_SIGNAL: (GObject.SignalFlags.RUN_FIRST, None, (str,)),
+        AGENT_UPDATE_USAGE_SIGNAL: (GObject.SignalFlags.RUN_FIRST, None, (str,)),
     }
 
     def __init__(
@@ -46,15 +69,29 @@ class AgentService(BaseService):
         llm: LlmService,
         history: HistoryService,
         mcp: McpService,
+        ledger: LedgerService,
     ):
         super().__init__(service_name="agent")
         self._configuration = configuration
         self._desktop = desktop
         self._llm = llm
+        self._llm.connect(LLM_STATUS_SIGNAL, self._on_llm_status)
         self._history = history
         self._mcp = mcp
+        self._ledger = ledger
+        self._tool_catalog = ToolCatalog(mcp=mcp, desktop=desktop)
+        self._tool_selector = ToolSelector(
+            configuration.config.tool_search, desktop=desktop, http_pool=llm.http_pool
+        )
+        self._history_compactor = HistoryCompactor(
+            configuration.config.compaction,
+            history=history,
+            llm=llm,
+            on_response=self._record_usage,
+        )
         self._session_id: str | None = None
-        self._current_iterations = 0
+        self._checkpoint: AgentCheckpoint | None = None
+        self._tool_runner: Optional[ToolRunner] = None  # started while streaming
         self._setup()
         self._logger.info("Initialized.")
 
@@ -62,10 +99,39 @@ class AgentService(BaseService):
         """Set the session ID for this agent and share it with the history service."""
         self._session_id = session_id
         self._history.set_session_id(session_id)
+        self._ledger.reset()
+        self._checkpoint = None
+        self._tool_runner = None
+
+    def restore_session(self, session_id: str) -> bool:
+        """Load a stored session, e.g. to resume a run that was interrupted
+        when the app was closed."""
+        if not self._history.load_session(session_id):
+            return False
+        self._session_id = session_id
+        self._ledger.reset()
+        self._tool_runner = None
+        self._checkpoint = None
+        session_dir = self._history.session_dir
+        path = session_dir / CHECKPOINT_FILE if session_dir else None
+        if path is not None and path.exists():
+            try:
+                self._checkpoint = AgentCheckpoint.model_validate_json(path.read_text())
+            except Exception as e:
+                self._logger.error(f"Failed to load checkpoint from {path}: {e}")
+        return True
+
+    @property
+    def messages(self) -> list[BaseMessage]:
+        return self._history.messages
 
     def shutdown(self):
         pass
 
+    @property
+    def tools(self) -> list[types.Tool]:
+        return self._tool_catalog.tools
+
     def _add_message(self, message: BaseMessage):
         """Add a message to the conversation history and notify the UI."""
         self._history.add_message(message)
@@ -74,73 +140,165 @@ class AgentService(BaseService):
         elif message.role == MessageRole.TOOL:
             self.safe_emit(AGENT_UPDATE_TOOL_SIGNAL, message.model_dump_json())
 
+    def _record_usage(self, message: ResponseMessage):
+        update = self._ledger.record(message)
+        update.rate_limits = self._llm.rate_limit_status
+        self.safe_emit(AGENT_UPDATE_USAGE_SIGNAL, update.model_dump_json())
+
+    def _on_llm_status(self, llm_service, status: str):
+        self.safe_emit(AGENT_UPDATE_STATUS_SIGNAL, status)
+
+    def _on_delta(self, delta: ResponseDelta):
+        """Notify the UI of partial content while the LLM is still generating."""
+        self.safe_emit(AGENT_UPDATE_AI_DELTA_SIGNAL, delta.model_dump_json())
+
     def _setup(self):
         self._logger.info("Setting up agent.")
         self.safe_emit(AGENT_READY_SIGNAL)
 
     async def run(self, request: AgentRequest):
         self._logger.info(f"Running agent with session ID: {request.session_id}")
-        self._current_iterations = 0
-        self.safe_emit(AGENT_RUN_STARTED_SIGNAL)
         self._add_message(request.message)
-        await self._run_llm()
+        self._checkpoint = AgentCheckpoint(step=AgentStep.AWAITING_LLM)
+        await self._run_loop()
 
-    async def _run_llm(self):
-        try:
-            self._current_iterations += 1
-            max_iterations = self._configuration.config.max_iterations
-            if self._current_iterations > max_iterations:
-                raise ValueError(
-                    f"Maximum iterations limit reached ({max_iterations}). "
-                    "The agent may be stuck in a loop."
-                )
+    async def resume(self):
+        """Continue the last run from its last completed step, e.g. after an
+        error or after the app was closed in the middle of it."""
+        checkpoint = self._checkpoint
+        if checkpoint is None or not self.can_resume:
+            raise ValueError("There is no interrupted run to resume.")
+        self._logger.info(f"Resuming agent at {checkpoint.step.value}.")
+        await self._run_loop()
+
+    @property
+    def can_resume(self) -> bool:
+        checkpoint = self._checkpoint
+        if checkpoint is None or checkpoint.step == AgentStep.DONE:
+            return False
+        # Resuming does not get around the limit, the next message would be over it
+        max_iterations = self._configuration.config.max_iterations
+        return not (
+            checkpoint.step == AgentStep.AWAITING_LLM
+            and checkpoint.iterations >= max_iterations
+        )
 
-            # Good to proceed
-            self._logger.info(f"LLM run {self._current_iterations}/{max_iterations}")
-            mcp_tools = [tool for tools in self._mcp.tools.values() for tool in tools]
-            tools = mcp_tools + self._desktop.get_tools()
-            message = await self._llm.generate_message(self._history.messages, tools)
-            self._add_message(message)
-            await self._handle_response(message)
+    async def _run_loop(self):
+        """Run the steps of the agent loop until it is done. Each step starts
+        from the checkpoint, which is stored after every transition."""
+        checkpoint = self._checkpoint
+        if checkpoint is None:
+            raise ValueError("The agent loop has no checkpoint.")
+
+        self._ledger.start_run()
+        self.safe_emit(AGENT_RUN_STARTED_SIGNAL)
+        try:
+            checkpoint.error = None
+            self._store_checkpoint()
+            while checkpoint.step != AgentStep.DONE:
+                if checkpoint.step == AgentStep.AWAITING_LLM:
+                    await self._generate_step(checkpoint)
+                elif checkpoint.step == AgentStep.EXECUTING_TOOLS:
+                    await self._execute_tools_step(checkpoint)
+                self._store_checkpoint()
+            response = AgentResponse(is_error=False)
+        except asyncio.CancelledError:
+            # Stopped by the user, it can be resumed from the checkpoint too
+            self._logger.info("Run cancelled.")
+            self._store_checkpoint()
+            response = AgentResponse(
+                is_error=False, is_cancelled=True, resumable=self.can_resume
+            )
+            self.safe_emit(AGENT_RUN_COMPLETED_SIGNAL, response.model_dump_json())
+            raise
         except Exception as e:
-            # This breaks the loop. Under which circumstances could we continue?
-            agent_response = AgentResponse(
+            # This breaks the loop, which can be resumed from the checkpoint
+            checkpoint.error = str(e)
+            self._store_checkpoint()
+            response = AgentResponse(
                 is_error=True,
+                resumable=self.can_resume,
                 message=SolMessage(
                     role=MessageRole.SOL,
-                    message=f"Error during LLM run ({self._current_iterations}/{self._configuration.config.max_iterations}): {e}",
+                    message=f"Error during LLM run ({checkpoint.iterations}/{self._configuration.config.max_iterations}): {e}",
                 ),
             )
-            self.safe_emit(AGENT_RUN_COMPLETED_SIGNAL, agent_response.model_dump_json())
+        self.safe_emit(AGENT_RUN_COMPLETED_SIGNAL, response.model_dump_json())
 
-    async def _handle_response(self, message: ResponseMessage):
-        if message.stop_reason == StopReason.END_TURN:
-            response = AgentResponse(is_error=False)
-            self.safe_emit(AGENT_RUN_COMPLETED_SIGNAL, response.model_dump_json())
-        elif message.stop_reason == StopReason.TOOL_USE:
+    async def _generate_step(self, checkpoint: AgentCheckpoint):
+        # Counted over the whole run, including before it was resumed
+        max_iterations = self._configuration.config.max_iterations
+        if checkpoint.iterations >= max_iterations:
+            raise ValueError(
+                f"Maximum iterations limit reached ({max_iterations}). "
+                "The agent may be stuck in a loop."
+            )
+
+        # Good to proceed
+        self._logger.info(f"LLM run {checkpoint.iterations + 1}/{max_iterations}")
+        tools = await self._tool_selector.select(
+            self._history.messages, self._tool_catalog.tools
+        )
+        runner = self._create_tool_runner()
+
+        def on_delta(delta: ResponseDelta):
+            self._on_delta(delta)
+            if delta.type == DeltaType.RESET:
+                runner.discard()
+            elif delta.type == DeltaType.TOOL_INPUT_END:
+                runner.start_early(
+                    ToolInputResponse(
+                        call_id=delta.call_id or "",
+                        environment=ToolEnvironment.LOCAL,
+                        name=delta.name or "",
+                        arguments=dict(delta.arguments or {}),
+                    )
+                )
+
+        try:
+            message = await self._llm.generate_message(
+                self._history.context_messages, tools, on_delta=on_delta
+            )
+        except BaseException:
+            runner.cancel()  # the message they were started for is discarded
+            raise
+        self._add_message(message)
+        checkpoint.iterations += 1
+        if message.stop_reason == StopReason.TOOL_USE:
             self._logger.info("Tool call detected, invoking tool.")
-            await self._handle_tool_use(message)
+            checkpoint.step = AgentStep.EXECUTING_TOOLS
+            checkpoint.message_id = message.id
+            self._tool_runner = runner
         else:
+            # E.g. it ran out of tokens after a tool use, which never runs
+            runner.cancel()
+            if message.stop_reason == StopReason.END_TURN:
+                checkpoint.step = AgentStep.DONE
+
+        # The message is in the history, a resumed run must not generate it
+        # again (or miss the results of its tool uses).
+        self._store_checkpoint()
+        if message.escalated_from is not None:
+            self._record_usage(message.escalated_from)
+        self._record_usage(message)
+        self._history_compactor.schedule(message)
+        if checkpoint.step == AgentStep.AWAITING_LLM:
             raise ValueError(f"Unhandled stop reason: {message.stop_reason}")
 
-    async def _handle_tool_use(self, message: ResponseMessage):
+    async def _execute_tools_step(self, checkpoint: AgentCheckpoint):
+        message = next(
+            (m for m in self._history.messages if m.id == checkpoint.message_id),
+            None,
+        )
+        if not isinstance(message, ResponseMessage):
+            raise ValueError(f"Message not found: {checkpoint.message_id}")
         tool_inputs = [
             content
             for content in message.content
             if isinstance(content, ToolInputResponse)
         ]
-
-        # Currently, we assume that one and only one tool input is present in
-        # each message. Parallel tool invocation is not supported.
-        # See e.g. Anthropic's ToolChoiceAutoParam.
         if len(tool_inputs) == 0:
             raise ValueError("Stop reason was tool use but no tool input was provided.")
-        elif len(tool_inputs) > 1:
-            self._logger.warning(
-                "Multiple tool inputs found, only the first one will be processed."
-            )
-
-        tool_input = tool_inputs[0]
 
         # Always add a message before invoking the LLM again. Otherwise, the
         # chain will be broken because LLMs like Anthropic expect a tool result
@@ -148,16 +306,65 @@ class AgentService(BaseService):
         # surface error messages by design as much as possible (rather than
         # swallowing/logging them) to pass them back to the LLM to inform its
         # execution.
+        runner, self._tool_runner = self._tool_runner, None
+        runner = runner or self._create_tool_runner()
+        try:
+            request_message = await self.call_tools(tool_inputs, runner)
+        except asyncio.CancelledError:
+            # Still one result per call, the calls that did not complete get
+            # an error, so that the history stays valid.
+            request_message = RequestMessage(
+                role=MessageRole.TOOL, content=runner.cancel(tool_inputs)
+            )
+            self._add_message(request_message)
+            checkpoint.step = AgentStep.AWAITING_LLM
+            checkpoint.message_id = None
+            raise
+        self._add_message(request_message)
+        checkpoint.step = AgentStep.AWAITING_LLM
+        checkpoint.message_id = None
+
+    def _store_checkpoint(self):
+        session_dir = self._history.session_dir
+        if session_dir is None or self._checkpoint is None:
+            return
+
+        try:
+            self._checkpoint.updated_at = get_now_utc()
+            session_dir.mkdir(parents=True, exist_ok=True)
+            path = session_dir / CHECKPOINT_FILE
+            path.write_text(self._checkpoint.model_dump_json(indent=2))
+        except Exception as e:
+            self._logger.error(f"Failed to store checkpoint in {session_dir}: {e}")
+
+    async def call_tools(
+        self,
+        tool_inputs: list[ToolInputResponse],
+        runner: Optional[ToolRunner] = None,
+    ) -> RequestMessage:
+        """Invoke the tools of a message, and return all the results as a
+        single message, in the order of the calls. The runner might already
+        have started some of them while the message was streamed."""
+        runner = runner or self._create_tool_runner()
+        content = await runner.run(tool_inputs)
+        return RequestMessage(role=MessageRole.TOOL, content=content)
+
+    def _create_tool_runner(self) -> ToolRunner:
+        return ToolRunner(
+            self.call_tool,
+            is_serial=self._desktop.is_serial,
+            is_read_only=self._tool_catalog.is_read_only,
+        )
+
+    async def call_tool(self, tool_input: ToolInputResponse) -> RequestMessage:
+        """Invoke a desktop or MCP tool, and return the result as the message
+        to send back to the LLM. Errors are part of the result."""
         if self._desktop.is_tool(tool_input.name):
             self._logger.info(f"Handling desktop tool: {tool_input.name}")
-            request_message = await self._handle_desktop_tool_use(tool_input)
-            self._add_message(request_message)
+            return await self._handle_desktop_tool_use(tool_input)
         else:
             self._logger.info(f"Handling MCP tool: {tool_input.name}")
-            request_message = await self._handle_mcp_tool_use(tool_input)
-            self._add_message(request_message)
-
-        await self._run_llm()
+            return await self._handle_mcp_tool_use(tool_input)
 
     async def _handle_desktop_tool_use(
         self, tool_input: ToolInputResponse
@@ -0,0 +1,165 @@
+"""
+
+Summarizes the older messages of long conversations, in the background.
+
+Once a request reaches the configured number of input tokens, the messages
+before the most recent ones are written out as a plain text transcript and
+summarized, usually by a cheaper model. The agent does not wait for it, the
+next iteration after the summary is ready sends it instead of the messages.
+
+The summary is sent as a human message, and the messages after it always
+start with an AI message, so the roles still alternate and every tool use
+that is still sent keeps its tool result. The previous summary is part of
+the transcript of the next one.
+
+"""
+
+import asyncio
+import json
+import logging
+from typing import Callable, Optional
+
+from speedoflight.models import (
+    BaseMessage,
+    CompactionConfig,
+    ImageBlockRequest,
+    ImageBlockResponse,
+    MessageRole,
+    RequestMessage,
+    ResponseMessage,
+    TextBlockRequest,
+    TextBlockResponse,
+    ToolImageOutputRequest,
+    ToolInputResponse,
+    ToolTextOutputRequest,
+    ToolTextOutputResponse,
+)
+from speedoflight.services.history import HistoryService
+from speedoflight.services.llm.llm_service import LlmService
+
+# Long tool outputs are cut in the transcript, the summary only needs the gist.
+MAX_OUTPUT_CHARS = 2000
+
+SUMMARY_PROMPT = """Summarize the conversation below between a user and an \
+AI assistant that uses tools on the user's computer. The summary replaces the \
+conversation, so keep what the assistant needs to continue: the user's \
+requests, decisions and preferences, what was done and its outcome, \
+including errors, and any names, paths, values or other details still \
+relevant. Be concise, only answer with the summary.
+
+<conversation>
+{transcript}
+</conversation>"""
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:"
+
+
+class HistoryCompactor:
+    def __init__(
+        self,
+        config: CompactionConfig,
+        history: HistoryService,
+        llm: LlmService,
+        on_response: Callable[[ResponseMessage], None],
+    ):
+        self._logger = logging.getLogger("agent.history_compactor")
+        self._config = config
+        self._history = history
+        self._llm = llm
+        self._on_response = on_response  # e.g. to record its usage
+        self._task: Optional[asyncio.Task] = None
+
+    def schedule(self, message: ResponseMessage):
+        """Start compacting in the background when the request that produced
+        the message was over the threshold."""
+        threshold = self._config.threshold
+        tokens = message.context_tokens
+        if threshold is None or tokens is None:
+            return
+        if self._task is not None and not self._task.done():
+            return
+        if tokens < threshold:
+            return
+
+        messages = list(self._history.messages)
+        end = self._get_end_index(messages)
+        if end is None:
+            return
+        self._logger.info(f"Request at {tokens} tokens, compacting {end} messages.")
+        self._task = asyncio.create_task(self._compact(messages, end))
+
+    def _get_end_index(self, messages: list[BaseMessage]) -> Optional[int]:
+        """Summarize up to the latest AI message that leaves enough recent
+        messages, none of its tool uses are summarized without its results."""
+        start = self._history.summarized_count
+        last = min(len(messages) - self._config.keep_messages, len(messages) - 1)
+        for index in range(last, start + 1, -1):  # at least two messages
+            if isinstance(messages[index], ResponseMessage):
+                return index
+        return None
+
+    async def _compact(self, messages: list[BaseMessage], end: int):
+        try:
+            summary = self._history.summary
+            start = self._history.summarized_count
+            transcript = [summary] if summary is not None else []
+            transcript += messages[start:end]
+            prompt = RequestMessage(
+                role=MessageRole.HUMAN,
+                content=[
+                    TextBlockRequest(
+                        text=SUMMARY_PROMPT.format(
+                            transcript=self._to_transcript(transcript)
+                        )
+                    )
+                ],
+            )
+            response = await self._llm.generate_summary([prompt])
+            self._on_response(response)
+            text = "\n".join(
+                block.text
+                for block in response.content
+                if isinstance(block, TextBlockResponse)
+            ).strip()
+            if not text:
+                raise ValueError("The summary is empty.")
+            # The session might have changed in the meantime
+            current = self._history.messages
+            if len(current) < end or current[end - 1] is not messages[end - 1]:
+                self._logger.info("History changed while compacting, discarded.")
+                return
+
+            self._history.compact(
+                RequestMessage(
+                    role=MessageRole.HUMAN,
+                    content=[TextBlockRequest(text=f"{SUMMARY_PREFIX}\n\n{text}")],
+                ),
+                end,
+            )
+        except Exception as e:
+            self._logger.warning(f"Failed to compact the history: {e}")
+
+    def _to_transcript(self, messages: list[BaseMessage]) -> str:
+        lines: list[str] = []
+        for message in messages:
+            if not isinstance(message, (RequestMessage, ResponseMessage)):
+                continue
+            speaker = "Assistant" if message.role == MessageRole.AI else "User"
+            for block in message.content:
+                if isinstance(block, (TextBlockRequest, TextBlockResponse)):
+                    lines.append(f"{speaker}: {block.text}")
+                elif isinstance(block, (ImageBlockRequest, ImageBlockResponse)):
+                    lines.append(f"{speaker}: [image]")
+                elif isinstance(block, ToolInputResponse):
+                    arguments = json.dumps(block.arguments)
+                    lines.append(f"Assistant used {block.name}: {arguments}")
+                elif isinstance(block, (ToolTextOutputRequest, ToolTextOutputResponse)):
+                    text = block.text
+                    if len(text) > MAX_OUTPUT_CHARS:
+                        text = f"{text[:MAX_OUTPUT_CHARS]}... [cut]"
+                    status = "failed" if block.is_error else "returned"
+                    lines.append(f"Tool {block.name} {status}: {text}")
+                elif isinstance(block, ToolImageOutputRequest):
+                    status = "failed" if block.is_error else "returned"
+                    lines.append(f"Tool {block.name} {status}: [image]")
+        return "\n\n".join(lines)
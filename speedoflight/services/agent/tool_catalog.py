@@ -0,0 +1,53 @@
+"""
+
+The tools offered to the LLM, from all MCP servers plus the desktop.
+
+The list is only rebuilt when an MCP server reports new tools, otherwise the
+very same list object is returned. LLM providers rely on this to compile their
+native tool definitions once per tool set, which also keeps the tool block
+byte-identical between requests, as prompt caching requires.
+
+"""
+
+import logging
+
+from mcp import types
+
+from speedoflight.models import ToolInputResponse
+from speedoflight.services.desktop import DesktopService
+from speedoflight.services.mcp import McpService
+
+
+class ToolCatalog:
+    def __init__(self, mcp: McpService, desktop: DesktopService):
+        self._logger = logging.getLogger("agent.tool_catalog")
+        self._mcp = mcp
+        self._desktop = desktop
+        self._version = -1
+        self._tools: list[types.Tool] = []
+        self._tools_by_name: dict[str, types.Tool] = {}
+
+    @property
+    def tools(self) -> list[types.Tool]:
+        self._refresh()
+        return self._tools
+
+    def is_read_only(self, tool_input: ToolInputResponse) -> bool:
+        """Whether the tool call has no side effects, as far as we know. MCP
+        servers tell with the `readOnlyHint` annotation of their tools."""
+        if self._desktop.is_tool(tool_input.name):
+            return self._desktop.is_read_only(tool_input)
+        self._refresh()
+        tool = self._tools_by_name.get(tool_input.name)
+        if tool is None or tool.annotations is None:
+            return False
+        return tool.annotations.readOnlyHint is True
+
+    def _refresh(self):
+        version = self._mcp.tools_version
+        if version != self._version:
+            mcp_tools = [tool for tools in self._mcp.tools.values() for tool in tools]
+            self._tools = mcp_tools + self._desktop.get_tools()
+            self._tools_by_name = {tool.name: tool for tool in self._tools}
+            self._version = version
+            self._logger.info(f"Tool set updated ({len(self._tools)} tools).")
@@ -0,0 +1,170 @@
+"""
+
+Runs the tool calls of a message, starting them while it is still streamed.
+
+Independent calls (e.g. MCP tools or a screenshot) run concurrently, calls
+that change the desktop (e.g. a click) wait for the calls before them, and
+the calls after them wait in turn. The results are returned in the order of
+the calls.
+
+The calls at the start of a message that only read (e.g. a screenshot, or MCP
+tools annotated as read-only) are started as soon as their input is complete
+in the stream, overlapping with the rest of the generation. The others only
+start with the complete message, since a request can still fail or be
+retried, and their side effects cannot be undone. Once the
+message is complete, the calls already started are matched with its tool
+inputs, and the rest are started.
+
+When the run is stopped, the calls still running are cancelled, and get an
+error result so that every call of the message still has one.
+
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Optional
+
+from speedoflight.models import RequestMessage, ToolInputResponse, ToolTextOutputRequest
+
+CallTool = Callable[[ToolInputResponse], Awaitable[RequestMessage]]
+IsSerial = Callable[[ToolInputResponse], bool]
+IsReadOnly = Callable[[ToolInputResponse], bool]
+
+CANCELLED_TEXT = "The tool call was cancelled by the user."
+
+
+class ToolRunner:
+    def __init__(
+        self, call_tool: CallTool, is_serial: IsSerial, is_read_only: IsReadOnly
+    ):
+        self._logger = logging.getLogger("agent.tool_runner")
+        self._call_tool = call_tool
+        self._is_serial = is_serial
+        self._is_read_only = is_read_only
+        self._reset()
+
+    def _reset(self):
+        self._inputs: list[ToolInputResponse] = []
+        self._started: list[tuple[str, dict[str, Any]]] = []  # name, arguments
+        self._tasks: list[asyncio.Task[RequestMessage]] = []
+        self._last_serial: Optional[asyncio.Task] = None
+        self._since_serial: list[asyncio.Task] = []
+        self._streaming = True  # only read-only calls so far
+
+    def start_early(self, tool_input: ToolInputResponse):
+        """Start a call whose input is complete, while the message is still
+        being generated."""
+        if not self._streaming:
+            return
+        if self._is_serial(tool_input) or not self._is_read_only(tool_input):
+            self._streaming = False  # the calls after it have to wait for it
+            return
+        self._logger.info(f"Starting {tool_input.name} before the end of the message.")
+        self._start(tool_input)
+
+    def discard(self):
+        """Cancel the calls started so far, e.g. when the request is retried,
+        the new message will start them again."""
+        self._cancel_tasks()
+        self._reset()
+
+    async def run(self, tool_inputs: list[ToolInputResponse]) -> list[Any]:
+        """Run the calls of the complete message, and return the content of
+        their results, in order."""
+        started = len(self._started)
+        matches = started <= len(tool_inputs) and all(
+            name == tool_input.name and arguments == tool_input.arguments
+            for (name, arguments), tool_input in zip(self._started, tool_inputs)
+        )
+        if not matches:
+            self._logger.warning("Tool calls do not match the message, restarting.")
+            self._cancel_tasks()
+            self._reset()
+            started = 0
+
+        self._streaming = False
+        self._inputs[:started] = tool_inputs[:started]  # e.g. with a call ID
+        for tool_input in tool_inputs[started:]:
+            self._start(tool_input)
+        if len(self._tasks) > 1:
+            self._logger.info(f"Invoking {len(self._tasks)} tools.")
+
+        # A call that raises still gets a result, the LLM expects one for
+        # each of them, and the others are not left behind.
+        results = await asyncio.gather(*self._tasks, return_exceptions=True)
+        content: list[Any] = []
+        for tool_input, result in zip(self._inputs, results):
+            if isinstance(result, BaseException):
+                self._logger.error(f"Error executing {tool_input.name}: {result}")
+                text = f"Error executing tool '{tool_input.name}': {result}"
+                content.append(self._error_result(tool_input, text))
+            else:
+                content.extend(self._content(tool_input, result))
+        return content
+
+    def cancel(
+        self, tool_inputs: Optional[list[ToolInputResponse]] = None
+    ) -> list[Any]:
+        """Cancel the calls still running, and return the content of the
+        results of the given calls, with an error for the ones that did not
+        complete."""
+        self._cancel_tasks()
+
+        content: list[Any] = []
+        for index, tool_input in enumerate(tool_inputs or []):
+            task = None
+            if index < len(self._tasks):
+                if self._inputs[index].call_id == tool_input.call_id:
+                    task = self._tasks[index]
+            if task is not None and task.done() and not task.cancelled():
+                if task.exception() is None:
+                    content.extend(self._content(tool_input, task.result()))
+                    continue
+            content.append(self._error_result(tool_input, CANCELLED_TEXT))
+        self._reset()
+        return content
+
+    def _cancel_tasks(self):
+        for task in self._tasks:
+            task.cancel()  # nothing happens if it is done
+
+    def _error_result(
+        self, tool_input: ToolInputResponse, text: str
+    ) -> ToolTextOutputRequest:
+        return ToolTextOutputRequest(
+            call_id=tool_input.call_id, name=tool_input.name, text=text, is_error=True
+        )
+
+    def _content(
+        self, tool_input: ToolInputResponse, result: RequestMessage
+    ) -> list[Any]:
+        content: list[Any] = []
+        for block in result.content:
+            if getattr(block, "call_id", tool_input.call_id) != tool_input.call_id:
+                block = block.model_copy(update={"call_id": tool_input.call_id})
+            content.append(block)
+        return content
+
+    def _start(self, tool_input: ToolInputResponse):
+        if self._is_serial(tool_input):
+            after = self._since_serial
+            if self._last_serial is not None:
+                after = [self._last_serial] + after
+            task = asyncio.create_task(self._run_after(after, tool_input))
+            self._last_serial = task
+            self._since_serial = []
+        else:
+            after = [self._last_serial] if self._last_serial is not None else []
+            task = asyncio.create_task(self._run_after(after, tool_input))
+            self._since_serial.append(task)
+
+        # The arguments are copied, the desktop tools modify them
+        self._started.append((tool_input.name, dict(tool_input.arguments)))
+        self._inputs.append(tool_input)
+        self._tasks.append(task)
+
+    async def _run_after(
+        self, after: list[asyncio.Task], tool_input: ToolInputResponse
+    ) -> RequestMessage:
+        await asyncio.gather(*after, return_exceptions=True)
+        return await self._call_tool(tool_input)
@@ -0,0 +1,234 @@
+"""
+
+Picks the tools most relevant to the current request, for large MCP catalogs.
+
+The MCP tools are ranked against the human message that started the run with
+a lexical index (BM25) of their names, descriptions and schemas, optionally
+fused with the similarity of Ollama embeddings. Only the top tools are sent,
+along with every desktop tool and every tool already used in the messages, so
+that tool uses in the history always refer to an offered tool.
+
+The ranking only changes with the human message, and the selection keeps the
+order of the catalog, so the tool block stays the same during a run, as
+prompt caching requires.
+
+"""
+
+import logging
+import math
+import re
+from collections import Counter
+from typing import Any, Optional
+
+from mcp import types
+from ollama import AsyncClient
+
+from speedoflight.models import (
+    BaseMessage,
+    MessageRole,
+    RequestMessage,
+    ResponseMessage,
+    TextBlockRequest,
+    ToolInputResponse,
+    ToolSearchConfig,
+)
+from speedoflight.services.desktop import DesktopService
+from speedoflight.services.llm.http_pool import HttpPool
+
+# BM25 parameters, the usual defaults.
+K1 = 1.5
+B = 0.75
+
+# Names say the most about a tool, they count as many times as this.
+NAME_WEIGHT = 3
+
+# Reciprocal rank fusion, how much the top ranks dominate.
+RRF_K = 60
+
+STOPWORDS = set(
+    "an and are as at be by can do for from get in is it me my of on or please "
+    "the this to use with you".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    # Also split identifiers, e.g. getWeather and get_weather
+    text = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", text)
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    return [word for word in words if len(word) > 1 and word not in STOPWORDS]
+
+
+class ToolSelector:
+    def __init__(
+        self, config: ToolSearchConfig, desktop: DesktopService, http_pool: HttpPool
+    ):
+        self._logger = logging.getLogger("agent.tool_selector")
+        self._config = config
+        self._desktop = desktop
+        self._embeddings_client: Optional[AsyncClient] = None
+        if config.embedding_model:
+            # Usually the same Ollama host as the LLM, so the same connections
+            self._embeddings_client = AsyncClient(
+                host=config.embedding_host, transport=http_pool.transport
+            )
+
+        # Index of the MCP tools, rebuilt when the catalog changes
+        self._source: Optional[list[types.Tool]] = None
+        self._documents: dict[str, list[str]] = {}  # tokens by tool name
+        self._texts: dict[str, str] = {}  # for the embeddings, by tool name
+        self._document_frequency: Counter[str] = Counter()
+        self._average_length = 0.0
+        self._embeddings: Optional[dict[str, list[float]]] = None
+
+        # Ranking for the last query, and the selection made from it
+        self._query: Optional[str] = None
+        self._ranking: list[str] = []
+        self._selection: list[types.Tool] = []
+        self._selected_names: set[str] = set()
+
+    async def select(
+        self, messages: list[BaseMessage], tools: list[types.Tool]
+    ) -> list[types.Tool]:
+        """The tools to send with the next request, or all of them when the
+        catalog is small enough."""
+        max_tools = self._config.max_tools
+        if max_tools is None or len(tools) <= max_tools:
+            return tools
+
+        if tools is not self._source:
+            self._build_index(tools)
+        query = self._get_query(messages)
+        if query != self._query:
+            self._ranking = await self._rank(query)
+            self._query = query
+
+        names = set(self._ranking[:max_tools]) | self._get_used_tools(messages)
+        names |= {tool.name for tool in tools if self._desktop.is_tool(tool.name)}
+        if names != self._selected_names:
+            # The same list object while the selection stays the same, the
+            # providers only compile their native tools when it changes.
+            self._selection = [tool for tool in tools if tool.name in names]
+            self._selected_names = names
+            self._logger.info(f"Selected {len(self._selection)} of {len(tools)} tools.")
+        return self._selection
+
+    def _build_index(self, tools: list[types.Tool]):
+        self._documents = {}
+        self._texts = {}
+        self._document_frequency = Counter()
+        for tool in tools:
+            if self._desktop.is_tool(tool.name):
+                continue  # always sent
+            tokens = tokenize(tool.name) * NAME_WEIGHT
+            tokens += tokenize(tool.description or "")
+            tokens += tokenize(" ".join(self._get_schema_text(tool.inputSchema)))
+            self._documents[tool.name] = tokens
+            self._texts[tool.name] = f"{tool.name}: {tool.description or ''}"
+            self._document_frequency.update(set(tokens))
+        lengths = [len(tokens) for tokens in self._documents.values()]
+        self._average_length = sum(lengths) / len(lengths) if lengths else 0.0
+        self._embeddings = None
+        self._source = tools
+        self._query = None
+
+    def _get_schema_text(self, schema: Any) -> list[str]:
+        """Property names and descriptions, at any depth."""
+        text: list[str] = []
+        if isinstance(schema, dict):
+            for key, value in schema.items():
+                if key == "properties" and isinstance(value, dict):
+                    text.extend(value.keys())
+                if key == "description" and isinstance(value, str):
+                    text.append(value)
+                else:
+                    text.extend(self._get_schema_text(value))
+        elif isinstance(schema, list):
+            for value in schema:
+                text.extend(self._get_schema_text(value))
+        return text
+
+    def _get_query(self, messages: list[BaseMessage]) -> str:
+        # The human message that started the run
+        for message in reversed(messages):
+            if (
+                isinstance(message, RequestMessage)
+                and message.role == MessageRole.HUMAN
+            ):
+                return " ".join(
+                    block.text
+                    for block in message.content
+                    if isinstance(block, TextBlockRequest)
+                )
+        return ""
+
+    def _get_used_tools(self, messages: list[BaseMessage]) -> set[str]:
+        return {
+            block.name
+            for message in messages
+            if isinstance(message, ResponseMessage)
+            for block in message.content
+            if isinstance(block, ToolInputResponse)
+        }
+
+    async def _rank(self, query: str) -> list[str]:
+        """Tool names, from the most to the least relevant."""
+        lexical = self._rank_lexical(query)
+        if self._embeddings_client is None:
+            return lexical
+
+        try:
+            semantic = await self._rank_semantic(query)
+        except Exception as e:
+            self._logger.warning(f"Failed to rank tools with embeddings: {e}")
+            return lexical
+
+        # Reciprocal rank fusion, robust to the different score scales
+        scores: Counter[str] = Counter()
+        for ranking in [lexical, semantic]:
+            for rank, name in enumerate(ranking):
+                scores[name] += 1.0 / (RRF_K + rank)
+        return [name for name, _ in scores.most_common()]
+
+    def _rank_lexical(self, query: str) -> list[str]:
+        query_tokens = set(tokenize(query))
+        count = len(self._documents)
+        scores: dict[str, float] = {}
+        for name, tokens in self._documents.items():
+            frequencies = Counter(tokens)
+            length_norm = 1 - B + B * len(tokens) / (self._average_length or 1.0)
+            score = 0.0
+            for token in query_tokens:
+                frequency = frequencies.get(token, 0)
+                if frequency == 0:
+                    continue
+                df = self._document_frequency[token]
+                idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+                score += idf * frequency * (K1 + 1) / (frequency + K1 * length_norm)
+            scores[name] = score
+        # Stable for ties, so that the selection does not flip between runs
+        return sorted(scores, key=lambda name: -scores[name])
+
+    async def _rank_semantic(self, query: str) -> list[str]:
+        client = self._embeddings_client
+        model = self._config.embedding_model or ""
+        if client is None:
+            return []
+
+        if self._embeddings is None:
+            names = list(self._texts.keys())
+            response = await client.embed(model=model, input=list(self._texts.values()))
+            self._embeddings = dict(zip(names, response.embeddings))
+            self._logger.info(f"Embedded {len(names)} tools with {model}.")
+
+        response = await client.embed(model=model, input=query)
+        query_embedding = response.embeddings[0]
+        similarities = {
+            name: self._cosine(query_embedding, embedding)
+            for name, embedding in self._embeddings.items()
+        }
+        return sorted(similarities, key=lambda name: -similarities[name])
+
+    def _cosine(self, a: list[float], b: list[float]) -> float:
+        dot = sum(x * y for x, y in zip(a, b))
+        norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+        return dot / norm if norm else 0.0
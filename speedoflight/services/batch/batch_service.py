@@ -0,0 +1,216 @@
+"""
+
+Runs many independent prompts through the Anthropic Message Batches API,
+which is cheaper and has higher throughput than one interactive request at a
+time, at the cost of latency (results can take up to 24 hours).
+
+Every round submits the next request of all the unfinished conversations as a
+single batch. Tool uses are then invoked through the AgentService as usual,
+and the conversations that need another LLM iteration go into the next round.
+Each conversation is stored as a regular session.
+
+Every request goes through its own context budget, so old turns are dropped
+and old images evicted just like in the app. Polling the batch is retried on
+transient errors, if it still fails the batch ID is kept in the results of
+its conversations so they can be fetched later.
+
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, TypeVar
+
+from speedoflight.models import (
+    BaseMessage,
+    BatchJobResult,
+    BatchJobStatus,
+    MessageRole,
+    RequestMessage,
+    ResponseMessage,
+    StopReason,
+    TextBlockRequest,
+    TextBlockResponse,
+    ToolInputResponse,
+)
+from speedoflight.services.agent import AgentService
+from speedoflight.services.base_service import BaseService
+from speedoflight.services.configuration import ConfigurationService
+from speedoflight.services.history import HistoryService
+from speedoflight.services.llm.anthropic_llm import AnthropicLlm
+from speedoflight.services.llm.context_budget import ContextBudget
+from speedoflight.services.llm.llm_service import LlmService
+from speedoflight.services.llm.retry_policy import RetryPolicy
+from speedoflight.utils import generate_uuid
+
+# Batches usually take minutes, there is no point in polling more often.
+DEFAULT_POLL_INTERVAL = 30.0  # seconds
+
+T = TypeVar("T")
+
+
+class BatchJob:
+    def __init__(self, prompt: str, context_budget: ContextBudget):
+        self.session_id = generate_uuid()
+        self.prompt = prompt
+        self.history = HistoryService()
+        self.history.set_session_id(self.session_id)
+        self.context_budget = context_budget
+        self.window: list[BaseMessage] = []  # The messages last sent
+        self.status = BatchJobStatus.PENDING
+        self.batch_id: str | None = None
+        self.iterations = 0
+        self.text: str | None = None
+        self.error: str | None = None
+
+    def to_result(self) -> BatchJobResult:
+        return BatchJobResult(
+            session_id=self.session_id,
+            prompt=self.prompt,
+            status=self.status,
+            batch_id=self.batch_id,
+            iterations=self.iterations,
+            text=self.text,
+            error=self.error,
+        )
+
+
+class BatchService(BaseService):
+    def __init__(
+        self,
+        configuration: ConfigurationService,
+        llm: LlmService,
+        agent: AgentService,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+    ):
+        super().__init__(service_name="batch")
+        self._configuration = configuration
+        self._agent = agent
+        self._poll_interval = poll_interval
+        self._retry_policy = RetryPolicy(configuration.config.retry)
+
+        client = llm.client
+        if not isinstance(client, AnthropicLlm):
+            raise ValueError("Batch runs require the Anthropic provider.")
+        self._client = client
+        self._logger.info("Initialized.")
+
+    async def run(self, prompts: list[str]) -> list[BatchJobResult]:
+        context_config = self._configuration.config.context
+        jobs = [BatchJob(prompt, ContextBudget(context_config)) for prompt in prompts]
+        for job in jobs:
+            job.history.add_message(
+                RequestMessage(
+                    role=MessageRole.HUMAN,
+                    content=[TextBlockRequest(text=job.prompt)],
+                )
+            )
+
+        max_iterations = self._configuration.config.max_iterations
+        for round_number in range(1, max_iterations + 1):
+            pending = [job for job in jobs if job.status == BatchJobStatus.PENDING]
+            if not pending:
+                break
+            self._logger.info(f"Round {round_number}: {len(pending)} conversations.")
+            await self._run_round(pending)
+
+        for job in jobs:
+            if job.status == BatchJobStatus.PENDING:
+                job.status = BatchJobStatus.FAILED
+                job.error = f"Maximum iterations limit reached ({max_iterations})."
+        return [job.to_result() for job in jobs]
+
+    async def _run_round(self, jobs: list[BatchJob]) -> None:
+        tools = self._agent.tools
+        for job in jobs:
+            job.window = await job.context_budget.fit(
+                self._client, job.history.context_messages, tools
+            )
+
+        conversations = {job.session_id: job.window for job in jobs}
+        # Not retried, a failed response might still have created the batch
+        batch_id = await self._client.create_batch(conversations, tools)
+        for job in jobs:
+            job.batch_id = batch_id
+
+        try:
+            while not await self._call_with_retries(
+                lambda: self._client.is_batch_ended(batch_id)
+            ):
+                await asyncio.sleep(self._poll_interval)
+            results = await self._call_with_retries(
+                lambda: self._client.get_batch_results(batch_id)
+            )
+        except Exception as e:
+            # The batch keeps running on the server, its ID is in the results
+            self._logger.error(f"Lost track of batch {batch_id}: {e}")
+            for job in jobs:
+                job.status = BatchJobStatus.FAILED
+                job.error = f"Failed to get the results of batch {batch_id}: {e}"
+            return
+
+        for job in jobs:
+            job.iterations += 1
+            result = results.get(job.session_id, "Missing from the batch results.")
+            if isinstance(result, str):
+                job.status = BatchJobStatus.FAILED
+                job.error = result
+                continue
+
+            if result.usage is not None:
+                job.context_budget.record_usage(job.window, tools, result.usage)
+            job.history.add_message(result)
+            try:
+                await self._handle_response(job, result)
+            except Exception as e:
+                job.status = BatchJobStatus.FAILED
+                job.error = str(e)
+
+    async def _handle_response(self, job: BatchJob, message: ResponseMessage) -> None:
+        if message.stop_reason == StopReason.END_TURN:
+            job.status = BatchJobStatus.COMPLETED
+            job.text = "\n".join(
+                block.text
+                for block in message.content
+                if isinstance(block, TextBlockResponse)
+            )
+        elif message.stop_reason == StopReason.TOOL_USE:
+            # Tools run one job at a time, desktop tools share a single desktop
+            tool_inputs = [
+                block
+                for block in message.content
+                if isinstance(block, ToolInputResponse)
+            ]
+            if not tool_inputs:
+                raise ValueError(
+                    "Stop reason was tool use but no tool input was provided."
+                )
+            job.history.add_message(await self._agent.call_tools(tool_inputs))
+        else:
+            raise ValueError(f"Unhandled stop reason: {message.stop_reason}")
+
+    async def _call_with_retries(self, call: Callable[[], Awaitable[T]]) -> T:
+        started_at = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return await call()
+            except Exception as e:
+                transient = self._client.classify_error(e)
+                if transient is None:
+                    raise
+
+                delay = self._retry_policy.get_delay(attempt, transient.retry_after)
+                elapsed = time.monotonic() - started_at
+                if elapsed + delay > self._retry_policy.deadline:
+                    self._logger.error(f"Giving up after {attempt} attempts: {e}")
+                    raise
+
+                self._logger.warning(
+                    f"Transient error ({transient.reason}) on attempt {attempt}, "
+                    f"retrying in {delay:.2f} seconds: {e}"
+                )
+                await asyncio.sleep(delay)
+
+    def shutdown(self):
+        pass
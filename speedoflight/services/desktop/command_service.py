@@ -39,9 +39,17 @@ class CommandService(BaseService):
             command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
         )
 
-        stdout, stderr = await asyncio.wait_for(
-            process.communicate(), timeout=RESPONSE_TIMEOUT
-        )
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                process.communicate(), timeout=RESPONSE_TIMEOUT
+            )
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            # E.g. the run was stopped, don't leave the command running
+            if process.returncode is None:
+                self._logger.info(f"Killing command: {command}")
+                process.kill()
+                await process.wait()
+            raise
 
         code = process.returncode
         if code == 0:
@@ -24,8 +24,13 @@ from speedoflight.services.configuration import ConfigurationService
 from speedoflight.services.desktop.clipboard_service import ClipboardService
 from speedoflight.services.desktop.remote_interface import RemoteInterface
 from speedoflight.services.desktop.screenshot_interface import ScreenshotInterface
+from speedoflight.services.desktop.screenshot_prefetcher import ScreenshotPrefetcher
 from speedoflight.services.desktop.xdotool_service import XdotoolService
 
+# Computer use actions that can run concurrently with other tool calls. The
+# others change the desktop, or in the case of `wait`, the timing.
+READ_ONLY_ACTIONS = {"screenshot", "cursor_position"}
+
 
 class DesktopService(BaseService):
     def __init__(self, configuration: ConfigurationService):
@@ -34,6 +39,9 @@ class DesktopService(BaseService):
         self._dotool = XdotoolService()
         self._remote = RemoteInterface()
         self._screenshot = ScreenshotInterface()
+        self._screenshot_prefetcher = ScreenshotPrefetcher(
+            configuration.config.screenshot, capture=self._take_screenshot
+        )
 
         self._is_multi_monitor = False
         self._target_monitor: Optional[Gdk.Monitor] = None
@@ -45,6 +53,7 @@ class DesktopService(BaseService):
 
         self._setup(display=display)
         self._clipboard = ClipboardService(display=display)
+        self._tools = self._create_tools()
         self._logger.info("Initialized.")
 
     def shutdown(self) -> None:
@@ -168,7 +177,29 @@ class DesktopService(BaseService):
             TOOL_COMPUTER_USE_NAME,
         ]
 
+    def is_serial(self, tool_input: ToolInputResponse) -> bool:
+        """Whether the tool call must run on its own, not concurrently with
+        other tool calls, e.g. a click that changes the desktop."""
+        if tool_input.name == TOOL_CLIPBOARD_SET_NAME:
+            return True
+        if tool_input.name == TOOL_COMPUTER_USE_NAME:
+            action = tool_input.arguments.get("action", None)
+            return action not in READ_ONLY_ACTIONS
+        return False
+
+    def is_read_only(self, tool_input: ToolInputResponse) -> bool:
+        """Whether the tool call has no side effects, e.g. a screenshot."""
+        if tool_input.name == TOOL_CLIPBOARD_GET_NAME:
+            return True
+        if tool_input.name == TOOL_COMPUTER_USE_NAME:
+            action = tool_input.arguments.get("action", None)
+            return action in READ_ONLY_ACTIONS
+        return False
+
     def get_tools(self) -> list[types.Tool]:
+        return self._tools
+
+    def _create_tools(self) -> list[types.Tool]:
         return [
             types.Tool(
                 name=TOOL_CLIPBOARD_GET_NAME,
@@ -202,14 +233,20 @@ class DesktopService(BaseService):
             elif tool_input.name == TOOL_CLIPBOARD_SET_NAME:
                 tool_result = self._clipboard.set_text(tool_input)
             elif tool_input.name == TOOL_COMPUTER_USE_NAME:
+                # The desktop changes, the next screenshot is taken after
+                changes_desktop = self.is_serial(tool_input)
+                if changes_desktop:
+                    self._screenshot_prefetcher.invalidate()
                 tool_result = await self._handle_computer_use(tool_input)
+                if changes_desktop:
+                    self._screenshot_prefetcher.schedule()
             else:
                 raise ValueError(f"Unknown desktop tool: {tool_input.name}")
         except Exception as e:
             tool_result = ToolTextOutputRequest(
                 call_id=tool_input.call_id,
                 name=tool_input.name,
-                is_error=False,
+                is_error=True,
                 text=f"Error executing desktop tool '{tool_input.name}': {e}",
             )
 
@@ -248,6 +285,13 @@ class DesktopService(BaseService):
             DesktopPoint(x=coordinate[0], y=coordinate[1])
         )
 
+    async def _take_screenshot(self) -> tuple[bool, str]:
+        return await self._screenshot.take_screenshot(
+            is_multi_monitor=self._is_multi_monitor,
+            target_monitor=self._target_monitor,
+            target_size=self._target_size,
+        )
+
     # TODO: Add action delays for some actions?
     # https://docs.anthropic.com/en/docs/agents-and-tools/tool-use/computer-use-tool#follow-implementation-best-practices
     async def _handle_computer_use(
@@ -264,11 +308,11 @@ class DesktopService(BaseService):
         match action:
             case "screenshot":
                 self._validate_args(action, args, [], [])
-                is_error, content = await self._screenshot.take_screenshot(
-                    is_multi_monitor=self._is_multi_monitor,
-                    target_monitor=self._target_monitor,
-                    target_size=self._target_size,
-                )
+                prefetched = await self._screenshot_prefetcher.take()
+                if prefetched is not None:
+                    content = prefetched
+                else:
+                    is_error, content = await self._take_screenshot()
             case "wait":
                 self._validate_args(action, args, [], ["duration"])
                 duration = args.get("duration", 2)
@@ -0,0 +1,72 @@
+"""
+
+Takes the next screenshot ahead of time, while the LLM is thinking.
+
+In computer use, the model usually asks for a screenshot right after each
+action that changes the desktop (e.g. a click). Once such an action is done,
+and the desktop had some time to settle, a screenshot is taken in the
+background. The next `screenshot` action is served from it if it is still
+fresh, instead of waiting for the portal round trip.
+
+"""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+from speedoflight.models import ScreenshotConfig
+
+# The screenshot interface returns whether it failed, and the encoded image
+# or the error message.
+Capture = Callable[[], Awaitable[tuple[bool, str]]]
+
+
+class ScreenshotPrefetcher:
+    def __init__(self, config: ScreenshotConfig, capture: Capture):
+        self._logger = logging.getLogger("desktop.screenshot_prefetcher")
+        self._config = config
+        self._capture = capture
+        self._task: Optional[asyncio.Task[tuple[str, float]]] = None
+
+    def schedule(self):
+        """Take a screenshot once the desktop settled, after an action."""
+        self.invalidate()
+        if self._config.prefetch:
+            self._task = asyncio.create_task(self._prefetch())
+
+    def invalidate(self):
+        """Forget the screenshot, e.g. before an action changes the desktop."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def take(self) -> Optional[str]:
+        """The prefetched screenshot, waiting for it if still in progress, or
+        None if there is none or it is too old."""
+        task, self._task = self._task, None  # each one is used once
+        if task is None:
+            return None
+
+        try:
+            encoded, taken_at = await asyncio.shield(task)
+        except Exception as e:
+            self._logger.warning(f"Failed to prefetch screenshot: {e}")
+            return None
+
+        age = time.monotonic() - taken_at
+        if age > self._config.max_age:
+            self._logger.info(f"Prefetched screenshot is too old ({age:.1f}s).")
+            return None
+        self._logger.info(f"Using prefetched screenshot ({age:.1f}s old).")
+        return encoded
+
+    async def _prefetch(self) -> tuple[str, float]:
+        await asyncio.sleep(self._config.settle_delay)
+
+        # Once started, a capture always runs to completion, so that the
+        # portal's temporary file is cleaned up even if it was invalidated.
+        is_error, content = await asyncio.shield(self._capture())
+        if is_error:
+            raise RuntimeError(content)
+        return content, time.monotonic()
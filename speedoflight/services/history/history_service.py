@@ -1,7 +1,12 @@
 from datetime import datetime
 from pathlib import Path
 
-from speedoflight.models import BaseMessage
+from speedoflight.models import (
+    BaseMessage,
+    MessageRole,
+    RequestMessage,
+    ResponseMessage,
+)
 from speedoflight.services.base_service import BaseService
 from speedoflight.utils import get_data_path
 
@@ -10,13 +15,16 @@ class HistoryService(BaseService):
     def __init__(self):
         super().__init__(service_name="history")
 
-        # TODO: This is a naive implementation. We should probably create a
-        # memory service where we track tokens limits and summarize old
-        # history as needed.
+        # The full history is kept, LlmService leaves out older messages from
+        # each request to fit the context window of the model. Once compacted,
+        # the messages before `_summarized_count` are sent as their summary.
         self._messages: list[BaseMessage] = []
+        self._summary: RequestMessage | None = None
+        self._summarized_count = 0
         self._session_id: str | None = None
         self._session_dir: Path | None = None
         self._messages_file: Path | None = None
+        self._summaries_file: Path | None = None
         self._directory_created: bool = False
         self._logger.info("Initialized.")
 
@@ -24,26 +32,72 @@ class HistoryService(BaseService):
         """Set the session ID for this history service."""
         self._session_id = session_id
         self._messages = []
+        self._summary = None
+        self._summarized_count = 0
 
         # Set up paths but don't create directories yet
         date_folder = datetime.now().strftime("%Y%m%d")
         self._session_dir = get_data_path() / "sessions" / date_folder / session_id
         self._messages_file = self._session_dir / "messages.jsonl"
+        self._summaries_file = self._session_dir / "summaries.jsonl"
         self._directory_created = False
         self._logger.info(f"Messages cleared, session ID set to: {session_id}")
 
+    def load_session(self, session_id: str) -> bool:
+        """Load the messages of a stored session, from any date. Summaries of
+        compacted messages are not loaded, the next compaction makes them
+        again."""
+        sessions_path = get_data_path() / "sessions"
+        session_dir = next(iter(sorted(sessions_path.glob(f"*/{session_id}"))), None)
+        if session_dir is None:
+            self._logger.error(f"Session not found: {session_id}")
+            return False
+
+        messages: list[BaseMessage] = []
+        try:
+            with open(session_dir / "messages.jsonl", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    message = BaseMessage.model_validate_json(line)
+                    if message.role == MessageRole.AI:
+                        messages.append(ResponseMessage.model_validate_json(line))
+                    else:
+                        messages.append(RequestMessage.model_validate_json(line))
+        except Exception as e:
+            self._logger.error(f"Failed to load session {session_id}: {e}")
+            return False
+
+        self.set_session_id(session_id)
+        self._session_dir = session_dir
+        self._messages_file = session_dir / "messages.jsonl"
+        self._summaries_file = session_dir / "summaries.jsonl"
+        self._messages = messages
+        self._logger.info(f"Loaded {len(messages)} messages from {session_dir}")
+        return True
+
     def add_message(self, message: BaseMessage):
         """Add a message to the conversation history."""
         self._messages.append(message)
 
         encoded = message.model_dump_json()
-        self._store_messages(encoded)
+        self._store(self._messages_file, encoded)
 
         total_messages = len(self._messages)
         self._logger.info(
             f"Added {message.role} message (total: {total_messages}): {message.id}"
         )
 
+    def compact(self, summary: RequestMessage, summarized_count: int):
+        """Send the summary instead of the first `summarized_count` messages,
+        which must end with a complete turn or tool result."""
+        if summarized_count <= self._summarized_count:
+            return  # e.g. an older compaction that finished late
+        self._summary = summary
+        self._summarized_count = summarized_count
+        self._store(self._summaries_file, summary.model_dump_json())
+        self._logger.info(f"Compacted {summarized_count} messages: {summary.id}")
+
     def _ensure_session_directory(self):
         """Create session directory structure if not already created."""
         if self._directory_created or not self._session_dir:
@@ -58,21 +112,42 @@ class HistoryService(BaseService):
                 f"Failed to create session directory {self._session_dir}: {e}"
             )
 
-    def _store_messages(self, encoded: str):
-        if not self._messages_file:
+    def _store(self, file: Path | None, encoded: str):
+        if not file:
             return
 
         try:
             self._ensure_session_directory()
-            with open(self._messages_file, "a", encoding="utf-8") as f:
+            with open(file, "a", encoding="utf-8") as f:
                 f.write(encoded + "\n")
         except Exception as e:
-            self._logger.error(f"Failed to write message to {self._messages_file}: {e}")
+            self._logger.error(f"Failed to write message to {file}: {e}")
+
+    @property
+    def session_dir(self) -> Path | None:
+        """Where the session is stored, it might not exist yet."""
+        return self._session_dir
 
     @property
     def messages(self) -> list[BaseMessage]:
         """Get the current message history."""
         return self._messages
 
+    @property
+    def context_messages(self) -> list[BaseMessage]:
+        """The messages to send to the LLM, starting with the summary of the
+        older ones once compacted."""
+        if self._summary is None:
+            return self._messages
+        return [self._summary] + self._messages[self._summarized_count :]
+
+    @property
+    def summarized_count(self) -> int:
+        return self._summarized_count
+
+    @property
+    def summary(self) -> RequestMessage | None:
+        return self._summary
+
     def shutdown(self):
         pass
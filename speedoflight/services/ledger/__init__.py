@@ -0,0 +1,3 @@
+from .ledger_service import LedgerService
+
+__all__ = ["LedgerService"]
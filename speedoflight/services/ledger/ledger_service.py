@@ -0,0 +1,97 @@
+import json
+
+from speedoflight.models import (
+    LlmCall,
+    ResponseMessage,
+    Usage,
+    UsageSummary,
+    UsageUpdate,
+)
+from speedoflight.services.base_service import BaseService
+from speedoflight.services.history import HistoryService
+from speedoflight.utils import generate_uuid
+
+USAGE_FILE = "usage.jsonl"  # One entry per LLM call
+SUMMARY_FILE = "usage.json"  # Totals per run and for the session
+
+
+class LedgerService(BaseService):
+    def __init__(self, history: HistoryService):
+        super().__init__(service_name="ledger")
+
+        # Stored next to the messages of the session
+        self._history = history
+        self._run_id: str | None = None
+        self._runs: dict[str, UsageSummary] = {}
+        self._session = UsageSummary()
+        self._logger.info("Initialized.")
+
+    def reset(self):
+        """Start over, e.g. for a new session."""
+        self._run_id = None
+        self._runs = {}
+        self._session = UsageSummary()
+
+    def start_run(self) -> str:
+        self._run_id = generate_uuid()
+        self._runs[self._run_id] = UsageSummary()
+        return self._run_id
+
+    def record(self, message: ResponseMessage) -> UsageUpdate:
+        """Add the usage of a generated message to the totals."""
+        run_id = self._run_id if self._run_id is not None else self.start_run()
+        usage = message.usage or Usage()
+        call = LlmCall(
+            message_id=message.id,
+            run_id=run_id,
+            provider=message.provider,
+            model=message.model,
+            usage=usage,
+            latency=message.latency,
+            time_to_first_byte=message.time_to_first_byte,
+            cost=message.cost or 0.0,
+        )
+        run = self._runs[run_id]
+        for summary in [run, self._session]:
+            summary.calls += 1
+            summary.input_tokens += usage.input_tokens or 0
+            summary.output_tokens += usage.output_tokens or 0
+            summary.cache_read_tokens += usage.cache_read_tokens or 0
+            summary.cache_write_tokens += usage.cache_write_tokens or 0
+            summary.latency += call.latency or 0.0
+            summary.cost += call.cost
+
+        self._store(call)
+        return UsageUpdate(
+            call=call, run=run.model_copy(), session=self._session.model_copy()
+        )
+
+    def _store(self, call: LlmCall):
+        session_dir = self._history.session_dir
+        if session_dir is None:
+            return
+
+        try:
+            session_dir.mkdir(parents=True, exist_ok=True)
+            with open(session_dir / USAGE_FILE, "a", encoding="utf-8") as f:
+                f.write(call.model_dump_json() + "\n")
+
+            # Small enough to be rewritten after every call
+            summary = {
+                "session": self._session.model_dump(mode="json"),
+                "runs": {
+                    run_id: run.model_dump(mode="json")
+                    for run_id, run in self._runs.items()
+                },
+            }
+            with open(session_dir / SUMMARY_FILE, "w", encoding="utf-8") as f:
+                json.dump(summary, f, indent=2)
+        except Exception as e:
+            self._logger.error(f"Failed to store usage in {session_dir}: {e}")
+
+    @property
+    def session(self) -> UsageSummary:
+        return self._session
+
+    def shutdown(self):
+        pass
@@ -1,11 +1,18 @@
 from datetime import datetime, timezone
-from typing import Iterable
+from typing import Any, Optional
 
 import httpx
-from anthropic import NOT_GIVEN, AsyncAnthropic
+from anthropic import (
+    NOT_GIVEN,
+    APIConnectionError,
+    APIStatusError,
+    AsyncAnthropic,
+)
 from anthropic._legacy_response import LegacyAPIResponse
+from anthropic.lib.streaming import BetaAsyncMessageStream, BetaMessageStreamEvent
 from anthropic.types.beta import (
     BetaBase64ImageSourceParam,
+    BetaCacheControlEphemeralParam,
     BetaImageBlockParam,
     BetaMessage,
     BetaMessageParam,
@@ -13,25 +20,32 @@ from anthropic.types.beta import (
     BetaTextBlock,
     BetaTextBlockParam,
     BetaThinkingBlock,
+    BetaThinkingConfigDisabledParam,
     BetaThinkingConfigEnabledParam,
     BetaToolChoiceAutoParam,
     BetaToolComputerUse20250124Param,
     BetaToolParam,
     BetaToolResultBlockParam,
     BetaToolUseBlock,
+    BetaToolUseBlockParam,
     BetaUsage,
     BetaWebSearchTool20250305Param,
     BetaWebSearchToolResultBlock,
     BetaWebSearchToolResultError,
 )
+from anthropic.types.beta.messages.batch_create_params import Request
 from mcp import types
+from pydantic import BaseModel
 
 from speedoflight.constants import TOOL_COMPUTER_USE_NAME, TOOL_WEB_SEARCH_NAME
 from speedoflight.models import (
     AnthropicConfig,
     BaseMessage,
+    DeltaType,
     MessageRole,
+    Pricing,
     RequestMessage,
+    ResponseDelta,
     ResponseMessage,
     StopReason,
     TextBlockRequest,
@@ -45,11 +59,28 @@ from speedoflight.models import (
     Usage,
 )
 from speedoflight.services.desktop import DesktopService
-from speedoflight.services.llm.base_llm import BaseLlmService
-from speedoflight.utils import is_empty, safe_json
+from speedoflight.services.llm.base_llm import (
+    BaseLlmService,
+    DeltaCallback,
+    StatusCallback,
+)
+from speedoflight.services.llm.http_pool import HttpPool
+from speedoflight.services.llm.rate_limiter import (
+    BUCKET_INPUT_TOKENS,
+    BUCKET_OUTPUT_TOKENS,
+    BUCKET_REQUESTS,
+    BUCKET_TOKENS,
+    RateLimiter,
+)
+from speedoflight.services.llm.retry_policy import TransientError, parse_retry_after
+from speedoflight.services.llm.thinking_policy import ThinkingPolicy
+from speedoflight.utils import generate_uuid, is_empty, safe_json
 
 # See: https://docs.anthropic.com/en/api/rate-limits#response-headers
 HEADER_RETRY_AFTER = "retry-after"
+HEADER_REQUESTS_LIMIT = "anthropic-ratelimit-requests-limit"
+HEADER_REQUESTS_REMAINING = "anthropic-ratelimit-requests-remaining"
+HEADER_REQUESTS_RESET = "anthropic-ratelimit-requests-reset"
 HEADER_INPUT_TOKENS_LIMIT = "anthropic-ratelimit-input-tokens-limit"
 HEADER_INPUT_TOKENS_REMAINING = "anthropic-ratelimit-input-tokens-remaining"
 HEADER_INPUT_TOKENS_RESET = "anthropic-ratelimit-input-tokens-reset"
@@ -60,28 +91,240 @@ HEADER_TOKENS_LIMIT = "anthropic-ratelimit-tokens-limit"
 HEADER_TOKENS_REMAINING = "anthropic-ratelimit-tokens-remaining"
 HEADER_TOKENS_RESET = "anthropic-ratelimit-tokens-reset"
 
+# Rate limiter bucket, log section, and headers (limit, remaining, reset).
+RATE_LIMIT_HEADERS = [
+    (
+        BUCKET_REQUESTS,
+        "Requests",
+        (HEADER_REQUESTS_LIMIT, HEADER_REQUESTS_REMAINING, HEADER_REQUESTS_RESET),
+    ),
+    (
+        BUCKET_INPUT_TOKENS,
+        "Input tokens",
+        (
+            HEADER_INPUT_TOKENS_LIMIT,
+            HEADER_INPUT_TOKENS_REMAINING,
+            HEADER_INPUT_TOKENS_RESET,
+        ),
+    ),
+    (
+        BUCKET_OUTPUT_TOKENS,
+        "Output tokens",
+        (
+            HEADER_OUTPUT_TOKENS_LIMIT,
+            HEADER_OUTPUT_TOKENS_REMAINING,
+            HEADER_OUTPUT_TOKENS_RESET,
+        ),
+    ),
+    (
+        BUCKET_TOKENS,
+        "Tokens",
+        (HEADER_TOKENS_LIMIT, HEADER_TOKENS_REMAINING, HEADER_TOKENS_RESET),
+    ),
+]
+
+# The default 5 minutes lifetime is refreshed on every hit, which is plenty
+# for the back-to-back requests of an agent run.
+CACHE_CONTROL = BetaCacheControlEphemeralParam(type="ephemeral")
+
+MIN_THINKING_BUDGET = 1024  # tokens
+
 
 class AnthropicLlm(BaseLlmService):
-    def __init__(self, config: AnthropicConfig, desktop: DesktopService):
+    def __init__(
+        self,
+        config: AnthropicConfig,
+        desktop: DesktopService,
+        http_pool: HttpPool,
+        offline: bool = False,  # e.g. replaying a cassette, nothing is sent
+    ):
         super().__init__(service_name="anthropic")
         self._config = config
         self._desktop = desktop
-        if is_empty(config.api_key):
+        if is_empty(config.api_key) and not offline:
             raise ValueError("An API key must be provided.")
-        self._client = AsyncAnthropic(api_key=config.api_key)
+        # Retries are handled by LlmService, which knows about the deadline
+        self._client = AsyncAnthropic(
+            api_key=config.api_key or None,
+            base_url=config.base_url,
+            max_retries=0,
+            http_client=http_pool.client,
+        )
+        self._rate_limiter = RateLimiter(self.service_name)
+        self._thinking_policy = ThinkingPolicy(config.thinking_mode)
+
+    @property
+    def pricing(self) -> Optional[Pricing]:
+        return self._config.pricing
+
+    async def prewarm(self, on_status: StatusCallback) -> None:
+        # Cheapest authenticated request, it also validates the API key
+        await self._client.models.list(limit=1)
 
     async def generate_message(
         self,
         app_messages: list[BaseMessage],
         tools: list[types.Tool],
+        on_delta: Optional[DeltaCallback] = None,
     ) -> ResponseMessage:
+        request = self._build_request(app_messages, tools)
+
+        # The message ID is generated upfront so that streamed deltas and the
+        # final response can be matched by the UI.
+        message_id = generate_uuid()
+        if self._config.enable_streaming:
+            message, headers = await self._stream_message(message_id, request, on_delta)
+        else:
+            message, headers = await self._create_message(request)
+        self._logger.debug(f"Generated message: {message}")
+
+        try:
+            self._track_rate_limits(headers, message.usage)
+        except Exception as e:
+            self._logger.error(f"Failed to track rate limits: {e}")
+
+        response = self.from_native(message)
+        response.id = message_id
+        return response
+
+    async def count_tokens(
+        self, app_messages: list[BaseMessage], tools: list[types.Tool]
+    ) -> Optional[int]:
+        # Same payload as the actual request, minus the output settings
+        request = self._build_request(app_messages, tools)
+        request.pop("max_tokens")
+        result = await self._client.beta.messages.count_tokens(**request)
+        return result.input_tokens
+
+    async def create_batch(
+        self, conversations: dict[str, list[BaseMessage]], tools: list[types.Tool]
+    ) -> str:
+        """Submit the next request of each conversation, by custom ID, as a
+        single Message Batch. Returns the ID of the batch."""
         betas = NOT_GIVEN
-        cloud_tools = []
-        messages: Iterable[BetaMessageParam] = [
-            self.to_native(msg) for msg in app_messages
+        requests = []
+        for custom_id, app_messages in conversations.items():
+            params = self._build_request(app_messages, tools)
+            betas = params.pop("betas")  # Set for the whole batch
+            # Unlike top level arguments, omitted values must not be present
+            params = {k: v for k, v in params.items() if v is not NOT_GIVEN}
+            requests.append(Request(custom_id=custom_id, params=params))  # type: ignore
+        batch = await self._client.beta.messages.batches.create(
+            requests=requests, betas=betas
+        )
+        self._logger.info(f"Created batch {batch.id} ({len(requests)} requests).")
+        return batch.id
+
+    async def is_batch_ended(self, batch_id: str) -> bool:
+        batch = await self._client.beta.messages.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        self._logger.info(
+            f"Batch {batch_id} is {batch.processing_status}: "
+            f"{counts.processing} processing, {counts.succeeded} succeeded, "
+            f"{counts.errored} errored."
+        )
+        return batch.processing_status == "ended"
+
+    async def get_batch_results(
+        self, batch_id: str
+    ) -> dict[str, ResponseMessage | str]:
+        """The response by custom ID, or the reason it failed."""
+        results: dict[str, ResponseMessage | str] = {}
+        decoder = await self._client.beta.messages.batches.results(batch_id)
+        async for entry in decoder:
+            result = entry.result
+            if result.type == "succeeded":
+                results[entry.custom_id] = self.from_native(result.message)
+            elif result.type == "errored":
+                results[entry.custom_id] = (
+                    f"Request failed: {result.error.error.message}"
+                )
+            else:
+                results[entry.custom_id] = f"Request {result.type}."
+        return results
+
+    def get_context_budget(self) -> int:
+        return self._config.context_window - self._config.max_tokens
+
+    def _build_request(
+        self, app_messages: list[BaseMessage], tools: list[types.Tool]
+    ) -> dict[str, Any]:
+        betas = NOT_GIVEN
+        if self._config.enable_computer_use:
+            betas = ["computer-use-2025-01-24"]
+
+        messages: list[BetaMessageParam] = self.to_native_messages(app_messages)
+        all_tools: list[Any] = self.get_native_tools(tools)
+        system: list[BetaTextBlockParam] = [
+            BetaTextBlockParam(
+                type="text",
+                text=self._get_system_prompt(
+                    computer_use=self._config.enable_computer_use
+                ),
+            )
         ]
 
-        native_tools: Iterable[BetaToolParam] = [
+        if self._config.enable_prompt_caching:
+            # Cached prefixes follow the order tools -> system -> messages. The
+            # first two are stable across iterations, and the moving breakpoint
+            # on the latest turn lets the next iteration read the whole
+            # conversation so far from the cache. The tools breakpoint is set
+            # by `to_native_tools`.
+            # https://docs.anthropic.com/en/docs/build-with-claude/prompt-caching
+            system[-1] = {**system[-1], "cache_control": CACHE_CONTROL}
+            if messages:
+                messages[-1] = self._add_cache_breakpoint(messages[-1])
+
+        # We ignore the temperature value when thinking because it's
+        # incompatible with enabling thinking:
+        # https://docs.anthropic.com/en/docs/build-with-claude/extended-thinking#feature-compatibility
+        thinking: Any = BetaThinkingConfigDisabledParam(type="disabled")
+        temperature: Any = self._config.temperature
+        thinking_budget = self._get_thinking_budget(app_messages)
+        if thinking_budget > 0:
+            thinking = BetaThinkingConfigEnabledParam(
+                type="enabled",
+                budget_tokens=max(MIN_THINKING_BUDGET, thinking_budget),
+            )
+            temperature = NOT_GIVEN
+
+        return dict(
+            max_tokens=self._config.max_tokens,
+            system=system,
+            thinking=thinking,
+            temperature=temperature,
+            messages=messages,
+            model=self._config.model,
+            tools=all_tools,
+            betas=betas,
+            tool_choice=BetaToolChoiceAutoParam(type="auto"),
+        )
+
+    def _get_thinking_budget(self, app_messages: list[BaseMessage]) -> int:
+        budget = self._thinking_policy.get_budget(
+            app_messages, self._config.thinking_budget
+        )
+        if budget > 0 and not self._can_think(app_messages):
+            return 0
+        return budget
+
+    def _can_think(self, app_messages: list[BaseMessage]) -> bool:
+        # Thinking cannot be turned back on in the middle of a tool use loop,
+        # the latest assistant message must then start with a thinking block.
+        # Note that toggling thinking also invalidates the cached messages.
+        # https://docs.anthropic.com/en/docs/build-with-claude/extended-thinking#extended-thinking-with-tool-use
+        for app_msg in reversed(app_messages):
+            if app_msg.role == MessageRole.HUMAN:
+                return True
+            if isinstance(app_msg, ResponseMessage):
+                if app_msg.provider != self.service_name or app_msg.raw is None:
+                    return False  # its thinking blocks are not sent
+                first_block = app_msg.content[0] if app_msg.content else None
+                return isinstance(first_block, ThinkingBlockResponse)
+        return True
+
+    def to_native_tools(self, tools: list[types.Tool]) -> list[Any]:
+        native_tools: list[BetaToolParam] = [
             BetaToolParam(
                 name=tool.name,
                 description=tool.description or tool.name,
@@ -90,6 +333,7 @@ class AnthropicLlm(BaseLlmService):
             for tool in tools
         ]
 
+        cloud_tools = []
         if self._config.enable_web_search:
             # TODO: Support additional parameters for web search
             # https://docs.anthropic.com/en/docs/agents-and-tools/tool-use/web-search-tool#tool-definition
@@ -101,7 +345,6 @@ class AnthropicLlm(BaseLlmService):
             )
 
         if self._config.enable_computer_use:
-            betas = ["computer-use-2025-01-24"]
             width, height = self._desktop.get_target_size()
             cloud_tools.append(
                 BetaToolComputerUse20250124Param(
@@ -112,77 +355,187 @@ class AnthropicLlm(BaseLlmService):
                 )
             )
 
-        # We ignore the temperature value because it's incompatible with
-        # enabling thinking:
-        # https://docs.anthropic.com/en/docs/build-with-claude/extended-thinking#feature-compatibility
+        all_tools: list[Any] = native_tools + cloud_tools
+        if self._config.enable_prompt_caching and all_tools:
+            all_tools[-1] = {**all_tools[-1], "cache_control": CACHE_CONTROL}
+        return all_tools
+
+    def _add_cache_breakpoint(self, message: BetaMessageParam) -> BetaMessageParam:
+        """Return a copy of the message with a cache breakpoint on its last
+        content block. The original message is not modified."""
+        content = message["content"]
+        if isinstance(content, str):
+            return BetaMessageParam(
+                role=message["role"],
+                content=[
+                    BetaTextBlockParam(
+                        type="text", text=content, cache_control=CACHE_CONTROL
+                    )
+                ],
+            )
+
+        blocks = list(content)
+        last_block = blocks[-1] if blocks else None
+
+        # Assistant messages are sent back as SDK models and end with text or
+        # tool use blocks in practice. Thinking blocks cannot be cached.
+        if isinstance(last_block, BaseModel):
+            last_block = last_block.model_dump(exclude_none=True)
+        if not isinstance(last_block, dict) or last_block.get("type") in [
+            "thinking",
+            "redacted_thinking",
+        ]:
+            self._logger.debug("Latest message cannot hold a cache breakpoint.")
+            return message
+
+        blocks[-1] = {**last_block, "cache_control": CACHE_CONTROL}  # type: ignore
+        return BetaMessageParam(role=message["role"], content=blocks)
+
+    def classify_error(self, error: Exception) -> Optional[TransientError]:
+        # Same criteria as the SDK's own retries, see `_should_retry`.
+        if isinstance(error, APIConnectionError):
+            return TransientError(reason=f"Connection error ({type(error).__name__})")
+        if isinstance(error, APIStatusError):
+            headers = error.response.headers
+            retry_after = parse_retry_after(headers)
+            should_retry = headers.get("x-should-retry")
+            if should_retry == "true":
+                return TransientError(
+                    reason="Server requested a retry", retry_after=retry_after
+                )
+            if should_retry == "false":
+                return None
+
+            status_code = error.status_code
+            if status_code in [408, 409, 429] or status_code >= 500:
+                return TransientError(
+                    reason=f"HTTP {status_code}",
+                    retry_after=retry_after,
+                )
+
+            # Errors in the middle of a stream arrive with a 200 status code,
+            # the error type is only available in the body.
+            body = error.body if isinstance(error.body, dict) else {}
+            error_type = body.get("error", {}).get("type")
+            if error_type in ["overloaded_error", "rate_limit_error", "api_error"]:
+                return TransientError(reason=error_type, retry_after=retry_after)
+        return super().classify_error(error)
+
+    async def _create_message(
+        self, request: dict[str, Any]
+    ) -> tuple[BetaMessage, httpx.Headers]:
         result: LegacyAPIResponse[
             BetaMessage
-        ] = await self._client.beta.messages.with_raw_response.create(
-            max_tokens=self._config.max_tokens,
-            system=self._get_system_prompt(
-                computer_use=self._config.enable_computer_use
-            ),
-            thinking=BetaThinkingConfigEnabledParam(type="enabled", budget_tokens=1024),
-            messages=messages,
-            model=self._config.model,
-            tools=native_tools + cloud_tools,
-            betas=betas,
-            tool_choice=BetaToolChoiceAutoParam(
-                type="auto", disable_parallel_tool_use=True
-            ),
-        )
+        ] = await self._client.beta.messages.with_raw_response.create(**request)
+        return result.parse(), result.headers
 
-        message: BetaMessage = result.parse()
-        self._logger.debug(f"Generated message: {message}")
-
-        try:
-            self._track_rate_limits(result.headers, message.usage)
-        except Exception as e:
-            self._logger.error(f"Failed to track rate limits: {e}")
+    async def _stream_message(
+        self,
+        message_id: str,
+        request: dict[str, Any],
+        on_delta: Optional[DeltaCallback],
+    ) -> tuple[BetaMessage, httpx.Headers]:
+        async with self._client.beta.messages.stream(**request) as stream:
+            async for event in stream:
+                if on_delta is None:
+                    continue
+                delta = self._to_delta(message_id, stream, event)
+                if delta is not None:
+                    on_delta(delta)
+            message = await stream.get_final_message()
+            return message, stream.response.headers
 
-        return self.from_native(message)
+    def _to_delta(
+        self,
+        message_id: str,
+        stream: BetaAsyncMessageStream,
+        event: BetaMessageStreamEvent,
+    ) -> Optional[ResponseDelta]:
+        """Convert a raw stream event into an application delta. The SDK also
+        emits convenience events (e.g. `text`), but they lack a block index."""
+        if event.type == "content_block_start":
+            block = event.content_block
+            if block.type in ["tool_use", "server_tool_use"]:
+                return ResponseDelta(
+                    message_id=message_id,
+                    index=event.index,
+                    type=DeltaType.TOOL_INPUT,
+                    name=block.name,  # type: ignore
+                    call_id=block.id,  # type: ignore
+                )
+        elif event.type == "content_block_delta":
+            delta = event.delta
+            if delta.type == "text_delta":
+                return ResponseDelta(
+                    message_id=message_id,
+                    index=event.index,
+                    type=DeltaType.TEXT,
+                    text=delta.text,
+                )
+            elif delta.type == "thinking_delta":
+                return ResponseDelta(
+                    message_id=message_id,
+                    index=event.index,
+                    type=DeltaType.THINKING,
+                    text=delta.thinking,
+                )
+            elif delta.type == "input_json_delta":
+                # The snapshot holds the partially parsed input so far
+                block = stream.current_message_snapshot.content[event.index]
+                arguments = getattr(block, "input", None)
+                return ResponseDelta(
+                    message_id=message_id,
+                    index=event.index,
+                    type=DeltaType.TOOL_INPUT,
+                    text=delta.partial_json,
+                    arguments=arguments if isinstance(arguments, dict) else None,
+                )
+        elif event.type == "content_block_stop":
+            # The agent can start a local tool as soon as its input is complete
+            block = stream.current_message_snapshot.content[event.index]
+            if block.type == "tool_use":
+                return ResponseDelta(
+                    message_id=message_id,
+                    index=event.index,
+                    type=DeltaType.TOOL_INPUT_END,
+                    name=block.name,
+                    call_id=block.id,
+                    arguments=block.input if isinstance(block.input, dict) else {},
+                )
+        return None
 
-    # TODO: Eventually surface this information in the UI.
     def _track_rate_limits(self, headers: httpx.Headers, usage: BetaUsage) -> None:
+        """Log the rate limit headers and feed them to the rate limiter, which
+        paces the following requests."""
         self._logger.info(f"Input tokens used: {usage.input_tokens}")
         self._logger.info(f"Output tokens used: {usage.output_tokens}")
+        self._logger.info(f"Cache read tokens: {usage.cache_read_input_tokens}")
+        self._logger.info(f"Cache write tokens: {usage.cache_creation_input_tokens}")
+
+        rate_limiter = self._rate_limiter
+        if rate_limiter is None:
+            return
+
+        # Cache reads do not count towards the input tokens rate limit
+        rate_limiter.record_usage(
+            input_tokens=usage.input_tokens + (usage.cache_creation_input_tokens or 0),
+            output_tokens=usage.output_tokens,
+        )
 
         retry_after = headers.get(HEADER_RETRY_AFTER)
         if retry_after:
             self._logger.info(f"Retry after: {retry_after} seconds")
+            rate_limiter.block_for(float(retry_after))
 
-        input_tokens_limit = int(headers.get(HEADER_INPUT_TOKENS_LIMIT))
-        input_tokens_remaining = int(headers.get(HEADER_INPUT_TOKENS_REMAINING))
-        input_tokens_reset_str = headers.get(HEADER_INPUT_TOKENS_RESET)
-        input_tokens_reset = datetime.fromisoformat(input_tokens_reset_str)
-        self._log_rate_limit(
-            "Input tokens",
-            input_tokens_limit,
-            input_tokens_remaining,
-            input_tokens_reset,
-        )
-
-        output_tokens_limit = int(headers.get(HEADER_OUTPUT_TOKENS_LIMIT))
-        output_tokens_remaining = int(headers.get(HEADER_OUTPUT_TOKENS_REMAINING))
-        output_tokens_reset_str = headers.get(HEADER_OUTPUT_TOKENS_RESET)
-        output_tokens_reset = datetime.fromisoformat(output_tokens_reset_str)
-        self._log_rate_limit(
-            "Output tokens",
-            output_tokens_limit,
-            output_tokens_remaining,
-            output_tokens_reset,
-        )
-
-        tokens_limit = int(headers.get(HEADER_TOKENS_LIMIT))
-        tokens_remaining = int(headers.get(HEADER_TOKENS_REMAINING))
-        tokens_reset_str = headers.get(HEADER_TOKENS_RESET)
-        tokens_reset = datetime.fromisoformat(tokens_reset_str)
-        self._log_rate_limit(
-            "Tokens",
-            tokens_limit,
-            tokens_remaining,
-            tokens_reset,
-        )
+        for bucket, section, names in RATE_LIMIT_HEADERS:
+            limit_header, remaining_header, reset_header = names
+            if headers.get(limit_header) is None:
+                continue  # Not every limit applies to every organization
+            limit = int(headers.get(limit_header))
+            remaining = int(headers.get(remaining_header))
+            reset = datetime.fromisoformat(headers.get(reset_header))
+            self._log_rate_limit(section, limit, remaining, reset)
+            rate_limiter.update_bucket(bucket, limit, remaining, reset)
 
     def _log_rate_limit(
         self, section: str, limit: int, remaining: int, reset: datetime
@@ -195,11 +548,13 @@ class AnthropicLlm(BaseLlmService):
         )
 
     def to_native(self, app_msg: BaseMessage) -> BetaMessageParam:
-        if isinstance(app_msg, ResponseMessage) and app_msg.raw is not None:
-            return BetaMessageParam(
-                role=app_msg.raw.role,
-                content=app_msg.raw.content,
-            )
+        if isinstance(app_msg, ResponseMessage):
+            if app_msg.raw is not None and app_msg.provider == self.service_name:
+                return BetaMessageParam(
+                    role=app_msg.raw.role,
+                    content=app_msg.raw.content,
+                )
+            return self._response_to_native(app_msg)
 
         if app_msg.role in [MessageRole.HUMAN, MessageRole.TOOL]:
             role = "user"  # Anthropic treats tool responses as user messages
@@ -253,6 +608,31 @@ class AnthropicLlm(BaseLlmService):
             content=content,
         )
 
+    def _response_to_native(self, app_msg: ResponseMessage) -> BetaMessageParam:
+        """Convert a message generated by another provider (e.g. after a
+        failover), only the text and the local tool uses carry over."""
+        content: list[Any] = []
+        for block in app_msg.content:
+            if isinstance(block, TextBlockResponse) and block.text:
+                content.append(BetaTextBlockParam(type="text", text=block.text))
+            elif (
+                isinstance(block, ToolInputResponse)
+                and block.environment == ToolEnvironment.LOCAL
+            ):
+                content.append(
+                    BetaToolUseBlockParam(
+                        type="tool_use",
+                        id=block.call_id,
+                        name=block.name,
+                        input=block.arguments,
+                    )
+                )
+            # Thinking blocks cannot be sent without Anthropic's signature
+
+        if len(content) == 0:
+            content.append(BetaTextBlockParam(type="text", text="(no content)"))
+        return BetaMessageParam(role="assistant", content=content)
+
     def from_native(self, native_msg: BetaMessage) -> ResponseMessage:
         if native_msg.role == "assistant":
             role = MessageRole.AI
@@ -280,6 +660,8 @@ class AnthropicLlm(BaseLlmService):
         usage = Usage(
             input_tokens=native_msg.usage.input_tokens,
             output_tokens=native_msg.usage.output_tokens,
+            cache_read_tokens=native_msg.usage.cache_read_input_tokens,
+            cache_write_tokens=native_msg.usage.cache_creation_input_tokens,
         )
 
         content = []
@@ -1,18 +1,72 @@
 from abc import abstractmethod
 from datetime import datetime
-from typing import Any
+from typing import Any, Callable, Optional
 
+import httpx
 from mcp import types
 
 from speedoflight.constants import APPLICATION_NAME
-from speedoflight.models import BaseMessage, ResponseMessage
+from speedoflight.models import (
+    BaseMessage,
+    Pricing,
+    ResponseDelta,
+    ResponseMessage,
+    Usage,
+)
 from speedoflight.services.base_service import BaseService
 from speedoflight.services.llm.prompts import COMPUTER_USE_PROMPT, SYSTEM_PROMPT
+from speedoflight.services.llm.rate_limiter import RateLimiter
+from speedoflight.services.llm.retry_policy import TransientError
+
+# Invoked with every incremental update while a response is being streamed.
+DeltaCallback = Callable[[ResponseDelta], None]
+
+# Invoked with progress updates meant for the user (e.g. the status bar).
+StatusCallback = Callable[[str], None]
 
 
 class BaseLlmService(BaseService):
     def __init__(self, service_name: str):
         super().__init__(service_name=service_name)
+        self._rate_limiter: Optional[RateLimiter] = None
+
+        # Native form of each message sent in the last request, by message ID.
+        # Messages never change once created, so each iteration only needs to
+        # convert the new ones (screenshots are hundreds of KB each).
+        self._native_messages: dict[str, Any] = {}
+
+        # Native tool definitions, compiled once per tool set. The catalog
+        # returns a new list whenever the tools change.
+        self._native_tools: Any = None
+        self._native_tools_source: Optional[list[types.Tool]] = None
+
+    @property
+    def rate_limiter(self) -> Optional[RateLimiter]:
+        """Only set for providers that report their rate limits."""
+        return self._rate_limiter
+
+    @property
+    def pricing(self) -> Optional[Pricing]:
+        return None
+
+    @property
+    def counts_cached_tokens(self) -> bool:
+        """Whether the input tokens it reports include the prefix it reused
+        from its cache, i.e. the whole prompt."""
+        return True
+
+    def get_cost(self, usage: Usage) -> float:
+        """Cost in USD, the input tokens do not include the cached ones."""
+        pricing = self.pricing
+        if pricing is None:
+            return 0.0
+        cost = (
+            (usage.input_tokens or 0) * pricing.input
+            + (usage.output_tokens or 0) * pricing.output
+            + (usage.cache_read_tokens or 0) * pricing.cache_read
+            + (usage.cache_write_tokens or 0) * pricing.cache_write
+        )
+        return cost / 1_000_000
 
     def _get_system_prompt(self, computer_use: bool = False) -> str:
         """Get the system/developer prompt for the LLM."""
@@ -25,13 +79,81 @@ class BaseLlmService(BaseService):
             COMPUTER_USE_PROMPT=computer_use_prompt,
         )
 
+    async def prewarm(self, on_status: StatusCallback) -> None:
+        """Send a cheap request, so that the connection to the provider is
+        already open when the first message is generated. Slow preparations
+        can report their progress with `on_status`."""
+        pass
+
+    async def preload(self, on_status: StatusCallback) -> None:
+        """Prepare the model before the first message (e.g. load it), even
+        when the connection is not prewarmed."""
+        pass
+
+    def shutdown(self):
+        pass
+
+    async def count_tokens(
+        self, app_messages: list[BaseMessage], tools: list[types.Tool]
+    ) -> Optional[int]:
+        """Exact number of input tokens for the request, for providers that
+        offer a counting endpoint. Otherwise None, and it is estimated."""
+        return None
+
+    def size_context(self, tokens: int) -> None:
+        """Called before each request with its estimated number of input
+        tokens, for providers where the context window is set per request."""
+        pass
+
+    @abstractmethod
+    def get_context_budget(self) -> int:
+        """Maximum number of input tokens, with room left for the output."""
+        pass
+
+    def classify_error(self, error: Exception) -> Optional[TransientError]:
+        """Return the details of a transient error that is worth retrying, or
+        None if it is permanent. Providers extend this with their own errors."""
+        if isinstance(error, (ConnectionError, TimeoutError, httpx.TransportError)):
+            return TransientError(reason=f"Connection error ({type(error).__name__})")
+        return None
+
     @abstractmethod
     async def generate_message(
         self,
         app_messages: list[BaseMessage],
         tools: list[types.Tool],
+        on_delta: Optional[DeltaCallback] = None,
     ) -> ResponseMessage:
-        """Generate a message response from the LLM provider."""
+        """Generate a message response from the LLM provider. When streaming
+        is enabled, partial content is reported through `on_delta` as it
+        arrives, and the complete message is returned at the end."""
+        pass
+
+    def to_native_messages(self, app_messages: list[BaseMessage]) -> list[Any]:
+        """Convert the messages with `to_native`, reusing the conversions from
+        the previous request. Messages that are no longer sent (e.g. left out
+        of the context window, or from a previous session) are forgotten."""
+        result = []
+        native_messages: dict[str, Any] = {}
+        for app_msg in app_messages:
+            native_msg = self._native_messages.get(app_msg.id)
+            if native_msg is None:
+                native_msg = self.to_native(app_msg)
+            native_messages[app_msg.id] = native_msg
+            result.append(native_msg)
+        self._native_messages = native_messages
+        return result
+
+    def get_native_tools(self, tools: list[types.Tool]) -> Any:
+        """Convert the tools with `to_native_tools`, only when they changed."""
+        if tools is not self._native_tools_source:
+            self._native_tools = self.to_native_tools(tools)
+            self._native_tools_source = tools
+        return self._native_tools
+
+    @abstractmethod
+    def to_native_tools(self, tools: list[types.Tool]) -> Any:
+        """Convert the tools to the AI's native tool definitions."""
         pass
 
     @abstractmethod
@@ -0,0 +1,59 @@
+"""
+
+Decides which model handles each iteration, when a cascade is configured.
+
+Most iterations of a run are mechanical follow-ups, e.g. taking a screenshot
+after a click, which a cheaper (or local) model handles just as well. The
+configured model is kept for planning a new request, recovering from a tool
+error, and anything the cheaper model did not handle with a tool use.
+
+"""
+
+from speedoflight.models import (
+    BaseMessage,
+    CascadeConfig,
+    MessageRole,
+    RequestMessage,
+    ResponseMessage,
+    StopReason,
+    ToolImageOutputRequest,
+    ToolTextOutputRequest,
+)
+
+
+class CascadePolicy:
+    def __init__(self, config: CascadeConfig):
+        self._config = config
+        self._routine_streak = 0  # consecutive iterations of the cheap model
+
+    def is_routine(self, app_messages: list[BaseMessage]) -> bool:
+        """Whether the next iteration can go to the cheap model."""
+        if self._routine_streak >= self._config.max_routine_iterations:
+            return False  # check in with the configured model once in a while
+        if len(app_messages) < 2:
+            return False
+
+        # Follows up on tool results, which all succeeded
+        last_message = app_messages[-1]
+        if not isinstance(last_message, RequestMessage):
+            return False
+        if last_message.role != MessageRole.TOOL:
+            return False
+        routine_tools = self._config.routine_tools
+        for block in last_message.content:
+            if not isinstance(block, (ToolTextOutputRequest, ToolImageOutputRequest)):
+                continue
+            if block.is_error:
+                return False
+            if routine_tools and block.name not in routine_tools:
+                return False
+
+        # Of a response that stopped for the tool use (e.g. not paused)
+        previous_message = app_messages[-2]
+        if not isinstance(previous_message, ResponseMessage):
+            return False
+        return previous_message.stop_reason == StopReason.TOOL_USE
+
+    def record(self, routine: bool):
+        """Keep track of the model that handled the last iteration."""
+        self._routine_streak = self._routine_streak + 1 if routine else 0
@@ -0,0 +1,219 @@
+"""
+
+Records the responses of an LLM to a cassette file, and replays them instead
+of calling the LLM. This runs the agent end-to-end without an API key or a
+loaded model, e.g. to profile the tools, the history and the UI in isolation.
+
+Each response is stored with the fingerprint of the request that produced it,
+a hash of the messages and the tools. IDs, timestamps and measurements (e.g.
+the latency) are left out of the fingerprint since they change on every run,
+and so is the image data, since screenshots are never pixel-identical.
+Requests with the same fingerprint are replayed in the order they were
+recorded.
+
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from mcp import types
+
+from speedoflight.models import (
+    BaseMessage,
+    CassetteConfig,
+    CassetteMode,
+    DeltaType,
+    Pricing,
+    ResponseDelta,
+    ResponseMessage,
+    TextBlockResponse,
+    ThinkingBlockResponse,
+    ToolEnvironment,
+    ToolInputResponse,
+)
+from speedoflight.services.llm.base_llm import (
+    BaseLlmService,
+    DeltaCallback,
+    StatusCallback,
+)
+from speedoflight.services.llm.retry_policy import TransientError
+
+# Left out of the fingerprint, see above. The usage, timings and cost of a
+# response are measured again on every run.
+MESSAGE_EXCLUDE = {
+    "id": True,
+    "created_at": True,
+    "usage": True,
+    "latency": True,
+    "time_to_first_byte": True,
+    "cost": True,
+    "content": {"__all__": {"id", "created_at", "data", "encoded", "text_html"}},
+}
+
+
+class CassetteLlm(BaseLlmService):
+    def __init__(self, config: CassetteConfig, llm: BaseLlmService):
+        super().__init__(service_name="cassette")
+        self._config = config
+        self._llm = llm  # Only used for its context budget and usage when replaying
+        self._path = Path(config.path).expanduser()
+        self._entries: dict[str, list[dict[str, Any]]] = {}  # by fingerprint
+        if config.mode == CassetteMode.RECORD:
+            self._rate_limiter = llm.rate_limiter
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            self._logger.info(f"Recording to {self._path}.")
+        else:
+            self._load()
+            self._logger.info(f"Replaying from {self._path}.")
+
+    def _load(self):
+        if not self._path.exists():
+            raise ValueError(f"Cassette not found: {self._path}")
+        with open(self._path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                self._entries.setdefault(entry["fingerprint"], []).append(entry)
+
+    async def generate_message(
+        self,
+        app_messages: list[BaseMessage],
+        tools: list[types.Tool],
+        on_delta: Optional[DeltaCallback] = None,
+    ) -> ResponseMessage:
+        fingerprint = self._get_fingerprint(app_messages, tools)
+        if self._config.mode == CassetteMode.RECORD:
+            return await self._record(fingerprint, app_messages, tools, on_delta)
+        return await self._replay(fingerprint, on_delta)
+
+    async def _record(
+        self,
+        fingerprint: str,
+        app_messages: list[BaseMessage],
+        tools: list[types.Tool],
+        on_delta: Optional[DeltaCallback],
+    ) -> ResponseMessage:
+        started_at = time.monotonic()
+        message = await self._llm.generate_message(app_messages, tools, on_delta)
+        entry = {
+            "fingerprint": fingerprint,
+            "latency": time.monotonic() - started_at,
+            "response": message.model_dump(mode="json"),
+        }
+        # Appended right away, so that a crash keeps the previous responses
+        with open(self._path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+        return message
+
+    async def _replay(
+        self, fingerprint: str, on_delta: Optional[DeltaCallback]
+    ) -> ResponseMessage:
+        entries = self._entries.get(fingerprint)
+        if not entries:
+            raise RuntimeError(f"No recorded response for request {fingerprint}.")
+        entry = entries.pop(0)
+
+        latency = self._config.latency
+        await asyncio.sleep(entry["latency"] if latency is None else latency)
+        message = self.from_native(entry["response"])
+        if on_delta is not None:
+            for index, block in enumerate(message.content):
+                delta = self._to_delta(message.id, index, block)
+                if delta is None:
+                    continue
+                on_delta(delta)
+                if (
+                    isinstance(block, ToolInputResponse)
+                    and block.environment == ToolEnvironment.LOCAL
+                ):
+                    on_delta(
+                        delta.model_copy(update={"type": DeltaType.TOOL_INPUT_END})
+                    )
+        return message
+
+    def _to_delta(
+        self, message_id: str, index: int, block: Any
+    ) -> Optional[ResponseDelta]:
+        # Each block is replayed as a single delta
+        if isinstance(block, TextBlockResponse):
+            delta_type, text = DeltaType.TEXT, block.text
+        elif isinstance(block, ThinkingBlockResponse):
+            delta_type, text = DeltaType.THINKING, block.text
+        elif isinstance(block, ToolInputResponse):
+            return ResponseDelta(
+                message_id=message_id,
+                index=index,
+                type=DeltaType.TOOL_INPUT,
+                name=block.name,
+                call_id=block.call_id,
+                arguments=block.arguments,
+            )
+        else:
+            return None
+        return ResponseDelta(
+            message_id=message_id, index=index, type=delta_type, text=text
+        )
+
+    def _get_fingerprint(
+        self, app_messages: list[BaseMessage], tools: list[types.Tool]
+    ) -> str:
+        request = {
+            "messages": self.to_native_messages(app_messages),
+            "tools": self.get_native_tools(tools),
+        }
+        encoded = json.dumps(request, sort_keys=True).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    async def prewarm(self, on_status: StatusCallback) -> None:
+        if self._config.mode == CassetteMode.RECORD:
+            await self._llm.prewarm(on_status)
+
+    async def preload(self, on_status: StatusCallback) -> None:
+        if self._config.mode == CassetteMode.RECORD:
+            await self._llm.preload(on_status)
+
+    def shutdown(self):
+        self._llm.shutdown()
+
+    async def count_tokens(
+        self, app_messages: list[BaseMessage], tools: list[types.Tool]
+    ) -> Optional[int]:
+        if self._config.mode == CassetteMode.RECORD:
+            return await self._llm.count_tokens(app_messages, tools)
+        return None
+
+    @property
+    def pricing(self) -> Optional[Pricing]:
+        return self._llm.pricing
+
+    @property
+    def counts_cached_tokens(self) -> bool:
+        return self._llm.counts_cached_tokens
+
+    def size_context(self, tokens: int) -> None:
+        self._llm.size_context(tokens)
+
+    def get_context_budget(self) -> int:
+        # The same budget as when recording, so that the same messages are sent
+        return self._llm.get_context_budget()
+
+    def classify_error(self, error: Exception) -> Optional[TransientError]:
+        return self._llm.classify_error(error)
+
+    def to_native_tools(self, tools: list[types.Tool]) -> str:
+        # The native form of the tools is their digest
+        encoded = json.dumps(
+            [tool.model_dump(mode="json") for tool in tools], sort_keys=True
+        ).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    def to_native(self, app_msg: BaseMessage) -> dict[str, Any]:
+        return app_msg.model_dump(mode="json", exclude=MESSAGE_EXCLUDE)
+
+    def from_native(self, native_msg: dict[str, Any]) -> ResponseMessage:
+        return ResponseMessage.model_validate(native_msg)
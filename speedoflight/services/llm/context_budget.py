@@ -0,0 +1,380 @@
+"""
+
+Keeps each request within the context window of the model.
+
+Tokens are estimated locally from the length of each message, with a ratio
+calibrated from the usage reported by the provider. Only when the estimate
+gets close to the budget do we ask the provider for an exact count (when it
+offers a counting endpoint), so most iterations pay no extra round trip.
+
+Older images are always replaced with a placeholder or a thumbnail, since
+screenshots are the biggest part of computer use requests. They are replaced
+several at a time, so that the prefix of the requests (cached by the
+provider) stays the same in between. Over the budget,
+whole turns are left out from the oldest, and then older tool outputs are
+replaced with a placeholder. All of these keep every tool use paired with its
+tool result. The history itself is never modified.
+
+"""
+
+import base64
+import json
+import logging
+from typing import Optional
+
+from gi.repository import GdkPixbuf  # type: ignore
+from mcp import types
+
+from speedoflight.models import (
+    BaseMessage,
+    ContextConfig,
+    ImageEviction,
+    ImageMimeType,
+    ImageBlockRequest,
+    ImageBlockResponse,
+    MessageRole,
+    RequestMessage,
+    ResponseMessage,
+    TextBlockRequest,
+    TextBlockResponse,
+    ThinkingBlockResponse,
+    ToolImageOutputRequest,
+    ToolInputResponse,
+    ToolTextOutputRequest,
+    ToolTextOutputResponse,
+    Usage,
+)
+from speedoflight.services.llm.base_llm import BaseLlmService
+
+CHARS_PER_TOKEN = 4
+
+# Images are scaled down by the provider, a screenshot at the target size
+# costs about (width * height) / 750 tokens, up to this value.
+IMAGE_TOKENS = 1600
+
+# Role markers and other per-message overhead.
+MESSAGE_TOKENS = 4
+
+# Ask the provider for an exact count once the estimate reaches this share of
+# the budget, and trim well below the budget so that the (cached) prefix of
+# the conversation stays the same for a while.
+VERIFY_RATIO = 0.8
+TRIM_RATIO = 0.7
+
+# Bounds for the calibrated ratio, in case of odd usage reports.
+MIN_RATIO = 0.5
+MAX_RATIO = 4.0
+
+OMITTED_OUTPUT = "[This tool output was removed to fit the context window.]"
+TRIMMED_ID_SUFFIX = "-trimmed"
+
+EVICTED_IMAGE = "[This older image was removed, newer images are available.]"
+EVICTED_ID_SUFFIX = "-evicted"
+THUMBNAIL_QUALITY = "70"  # JPEG
+
+
+class ContextBudget:
+    def __init__(self, config: ContextConfig):
+        self._logger = logging.getLogger("llm.context_budget")
+        self._config = config
+        self._thumbnails: dict[str, Optional[str]] = {}  # by block ID
+        self._message_tokens: dict[str, int] = {}  # by message ID
+        self._ratio = 1.0  # actual tokens / estimated tokens
+        self._tools_tokens = 0
+        self._tools_source: Optional[list[types.Tool]] = None
+
+        # Messages before this one were already left out, it only moves
+        # forward so that consecutive requests share the same prefix.
+        self._first_message_id: Optional[str] = None
+
+        # Same for the images, the ones before this message are replaced.
+        self._first_image_message_id: Optional[str] = None
+
+    async def fit(
+        self,
+        client: BaseLlmService,
+        messages: list[BaseMessage],
+        tools: list[types.Tool],
+    ) -> list[BaseMessage]:
+        """Return the messages to send, within the budget of the client."""
+        self._prune(messages)
+        budget = client.get_context_budget()
+        window = messages[self._get_index(messages, self._first_message_id) :]
+        window = self._evict_images(window)
+        tokens = self.estimate(window, tools)
+        if tokens <= budget * VERIFY_RATIO:
+            return window
+
+        try:
+            counted = await client.count_tokens(window, tools)
+        except Exception as e:
+            self._logger.warning(f"Failed to count tokens: {e}")
+            counted = None
+        if counted is not None:
+            self._calibrate(window, tools, counted)
+            tokens = counted
+        if tokens <= budget:
+            return window
+
+        target = int(budget * TRIM_RATIO)
+        self._logger.info(f"Request over budget ({tokens}/{budget}), trimming.")
+        window = self._drop_turns(window, tools, target)
+        if window:
+            self._first_message_id = window[0].id
+        window = self._omit_tool_outputs(window, tools, target)
+
+        tokens = self.estimate(window, tools)
+        if tokens > budget:
+            self._logger.warning(f"Request still over budget ({tokens}/{budget}).")
+        else:
+            self._logger.info(f"Trimmed request to {tokens} estimated tokens.")
+        return window
+
+    def record_usage(
+        self, messages: list[BaseMessage], tools: list[types.Tool], usage: Usage
+    ) -> None:
+        """Calibrate the estimates with the tokens the provider counted for
+        the messages that were actually sent."""
+        if usage.input_tokens is None:
+            return
+        actual = (
+            usage.input_tokens
+            + (usage.cache_read_tokens or 0)
+            + (usage.cache_write_tokens or 0)
+        )
+        self._calibrate(messages, tools, actual)
+
+    def estimate(self, messages: list[BaseMessage], tools: list[types.Tool]) -> int:
+        return int(self._estimate_raw(messages, tools) * self._ratio)
+
+    def estimate_ceiling(
+        self, messages: list[BaseMessage], tools: list[types.Tool]
+    ) -> int:
+        """The larger of the calibrated and uncalibrated estimates, for when
+        falling short is worse than being generous."""
+        raw = self._estimate_raw(messages, tools)
+        return max(raw, int(raw * self._ratio))
+
+    def _calibrate(
+        self, messages: list[BaseMessage], tools: list[types.Tool], actual: int
+    ) -> None:
+        raw = self._estimate_raw(messages, tools)
+        if raw <= 0 or actual <= 0:
+            return
+        ratio = min(MAX_RATIO, max(MIN_RATIO, actual / raw))
+        self._ratio = (self._ratio + ratio) / 2  # smooth out outliers
+        self._logger.debug(f"Token estimate ratio: {self._ratio:.2f}")
+
+    def _prune(self, messages: list[BaseMessage]) -> None:
+        """Forget the messages that are gone, e.g. after a compaction or in a
+        new session, the caches would grow for as long as the app runs."""
+        message_ids = {message.id for message in messages}
+        self._message_tokens = {
+            message_id: tokens
+            for message_id, tokens in self._message_tokens.items()
+            if message_id.removesuffix(TRIMMED_ID_SUFFIX).removesuffix(
+                EVICTED_ID_SUFFIX
+            )
+            in message_ids
+        }
+        block_ids = {
+            block.id
+            for message in messages
+            if isinstance(message, RequestMessage)
+            for block in message.content
+        }
+        self._thumbnails = {
+            block_id: thumbnail
+            for block_id, thumbnail in self._thumbnails.items()
+            if block_id in block_ids
+        }
+
+    def _get_index(self, messages: list[BaseMessage], message_id: Optional[str]) -> int:
+        if message_id is None:
+            return 0
+        for index, message in enumerate(messages):
+            if message.id == message_id:
+                return index
+        return 0  # e.g. a new session, or it was left out
+
+    def _estimate_raw(
+        self, messages: list[BaseMessage], tools: list[types.Tool]
+    ) -> int:
+        total = sum(self._get_message_tokens(message) for message in messages)
+        return total + self._get_tools_tokens(tools)
+
+    def _get_tools_tokens(self, tools: list[types.Tool]) -> int:
+        # The catalog returns the same list until the tools change
+        if tools is not self._tools_source:
+            chars = 0
+            for tool in tools:
+                chars += len(tool.name) + len(tool.description or "")
+                chars += len(json.dumps(tool.inputSchema))
+            self._tools_tokens = chars // CHARS_PER_TOKEN
+            self._tools_source = tools
+        return self._tools_tokens
+
+    def _get_message_tokens(self, message: BaseMessage) -> int:
+        cached = self._message_tokens.get(message.id)
+        if cached is not None:
+            return cached
+
+        tokens = MESSAGE_TOKENS
+        if isinstance(message, (RequestMessage, ResponseMessage)):
+            for block in message.content:
+                if isinstance(block, (ImageBlockRequest, ImageBlockResponse)):
+                    tokens += IMAGE_TOKENS
+                elif isinstance(block, ToolImageOutputRequest):
+                    tokens += IMAGE_TOKENS
+                elif isinstance(block, ToolInputResponse):
+                    chars = len(block.name) + len(json.dumps(block.arguments))
+                    tokens += chars // CHARS_PER_TOKEN
+                elif isinstance(
+                    block,
+                    (
+                        TextBlockRequest,
+                        TextBlockResponse,
+                        ThinkingBlockResponse,
+                        ToolTextOutputRequest,
+                        ToolTextOutputResponse,
+                    ),
+                ):
+                    tokens += len(block.text) // CHARS_PER_TOKEN
+
+        self._message_tokens[message.id] = tokens
+        return tokens
+
+    def _drop_turns(
+        self, messages: list[BaseMessage], tools: list[types.Tool], target: int
+    ) -> list[BaseMessage]:
+        """Leave out the oldest turns, a turn starts with a human message and
+        is followed by all the tool uses and results it triggered."""
+        turn_starts = [
+            index
+            for index, message in enumerate(messages)
+            if index > 0 and self._is_turn_start(message)
+        ]
+        for index in turn_starts:
+            if self.estimate(messages[index:], tools) <= target:
+                return messages[index:]
+        # The current turn is always kept
+        return messages[turn_starts[-1] :] if turn_starts else messages
+
+    def _is_turn_start(self, message: BaseMessage) -> bool:
+        return isinstance(message, RequestMessage) and message.role == MessageRole.HUMAN
+
+    def _omit_tool_outputs(
+        self, messages: list[BaseMessage], tools: list[types.Tool], target: int
+    ) -> list[BaseMessage]:
+        """Replace the oldest tool outputs with a placeholder. The latest
+        message is kept as is, the LLM has not seen it yet."""
+        result = list(messages)
+        tokens = self.estimate(result, tools)
+        for index, message in enumerate(result[:-1]):
+            if tokens <= target:
+                break
+            if not isinstance(message, RequestMessage):
+                continue
+            if message.role != MessageRole.TOOL:
+                continue
+
+            content = []
+            for block in message.content:
+                if isinstance(block, (ToolTextOutputRequest, ToolImageOutputRequest)):
+                    block = ToolTextOutputRequest(
+                        call_id=block.call_id,
+                        name=block.name,
+                        text=OMITTED_OUTPUT,
+                        is_error=block.is_error,
+                    )
+                content.append(block)
+
+            # Messages never change once created, the copy gets its own
+            # (stable) ID so that it is not mistaken for the original.
+            trimmed = message.model_copy(
+                update={"id": f"{message.id}{TRIMMED_ID_SUFFIX}", "content": content}
+            )
+            saved = self._get_message_tokens(message) - self._get_message_tokens(
+                trimmed
+            )
+            tokens -= int(saved * self._ratio)
+            result[index] = trimmed
+        return result
+
+    def _evict_images(self, messages: list[BaseMessage]) -> list[BaseMessage]:
+        """Keep only the most recent tool images at full resolution. Once there
+        are more than the maximum, only half of them are kept, so that the
+        same images are replaced for the next few requests."""
+        start = self._get_index(messages, self._first_image_message_id)
+        counts = [self._count_images(message) for message in messages]
+        if sum(counts[start:]) > self._config.max_images:
+            keep = max(1, self._config.max_images // 2)
+            boundary = len(messages) - 1  # the LLM has not seen it yet
+            kept = counts[boundary]
+            for index in range(boundary - 1, start - 1, -1):
+                if kept + counts[index] > keep:
+                    break
+                kept += counts[index]
+                boundary = index
+            self._first_image_message_id = messages[boundary].id
+            start = boundary
+
+        result = list(messages)
+        for index, message in enumerate(result[:start]):
+            if not counts[index] or not isinstance(message, RequestMessage):
+                continue
+            content = [
+                self._evict_image(block)
+                if isinstance(block, ToolImageOutputRequest)
+                else block
+                for block in message.content
+            ]
+            result[index] = message.model_copy(
+                update={"id": f"{message.id}{EVICTED_ID_SUFFIX}", "content": content}
+            )
+        return result
+
+    def _count_images(self, message: BaseMessage) -> int:
+        if not isinstance(message, RequestMessage):
+            return 0
+        return sum(
+            isinstance(block, ToolImageOutputRequest) for block in message.content
+        )
+
+    def _evict_image(
+        self, block: ToolImageOutputRequest
+    ) -> ToolImageOutputRequest | ToolTextOutputRequest:
+        if self._config.image_eviction == ImageEviction.THUMBNAIL:
+            if block.id not in self._thumbnails:
+                self._thumbnails[block.id] = self._create_thumbnail(block)
+            thumbnail = self._thumbnails[block.id]
+            if thumbnail is not None:
+                return block.model_copy(
+                    update={"data": thumbnail, "mime_type": ImageMimeType.JPEG}
+                )
+
+        return ToolTextOutputRequest(
+            call_id=block.call_id,
+            name=block.name,
+            text=EVICTED_IMAGE,
+            is_error=block.is_error,
+        )
+
+    def _create_thumbnail(self, block: ToolImageOutputRequest) -> Optional[str]:
+        try:
+            loader = GdkPixbuf.PixbufLoader.new_with_mime_type(block.mime_type.value)
+            loader.write(base64.b64decode(block.data))
+            loader.close()
+            pixbuf = loader.get_pixbuf()
+            width = min(self._config.thumbnail_width, pixbuf.get_width())
+            height = max(1, pixbuf.get_height() * width // pixbuf.get_width())
+            pixbuf = pixbuf.scale_simple(width, height, GdkPixbuf.InterpType.BILINEAR)
+            success, buffer = pixbuf.save_to_bufferv(  # type: ignore
+                "jpeg", ["quality"], [THUMBNAIL_QUALITY]
+            )
+            if not success:
+                raise RuntimeError("Failed to convert pixbuf to JPEG buffer")
+            return base64.b64encode(buffer).decode("utf-8")
+        except Exception as e:
+            self._logger.error(f"Failed to create thumbnail, using a placeholder: {e}")
+            return None
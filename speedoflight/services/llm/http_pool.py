@@ -0,0 +1,54 @@
+"""
+
+Connection pool shared by all the LLM clients.
+
+Each SDK would otherwise create its own httpx client with default settings,
+where idle connections are dropped after 5 seconds. Agent iterations are
+often further apart than that (e.g. while a tool runs), so every request paid
+DNS, TCP and TLS setup again. This matters most for an Ollama host on another
+machine on the LAN.
+
+"""
+
+import importlib.util
+import logging
+
+import httpx
+
+from speedoflight.models import HttpConfig
+
+
+class HttpPool:
+    def __init__(self, config: HttpConfig):
+        self._logger = logging.getLogger("llm.http_pool")
+        http2 = config.enable_http2
+        if http2 and importlib.util.find_spec("h2") is None:
+            self._logger.warning("HTTP/2 requires `httpx[http2]`, using HTTP/1.1.")
+            http2 = False
+
+        # The transport owns the connections, clients that do not accept an
+        # httpx client (like Ollama's) can still share it.
+        self._transport = httpx.AsyncHTTPTransport(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.max_keepalive_connections,
+                keepalive_expiry=config.keepalive_expiry,
+            ),
+        )
+        self._client = httpx.AsyncClient(
+            transport=self._transport,
+            timeout=httpx.Timeout(config.timeout, connect=config.connect_timeout),
+            follow_redirects=True,
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return self._client
+
+    @property
+    def transport(self) -> httpx.AsyncHTTPTransport:
+        return self._transport
+
+    async def aclose(self) -> None:
+        await self._client.aclose()  # Along with the transport
@@ -1,59 +1,478 @@
+import asyncio
 import os
+import time
+from typing import Any, Callable, Optional, TypeVar
 
+from gi.repository import GObject  # type: ignore
 from mcp import types
 
+from speedoflight.constants import LLM_STATUS_SIGNAL
+
 from speedoflight.models import (
     AnthropicConfig,
+    BaseLLMConfig,
     BaseMessage,
+    CassetteMode,
+    DeltaType,
     LLMProvider,
     OllamaConfig,
+    Pricing,
+    ResponseDelta,
     ResponseMessage,
+    StopReason,
 )
 from speedoflight.services.base_service import BaseService
 from speedoflight.services.configuration import ConfigurationService
 from speedoflight.services.desktop import DesktopService
 from speedoflight.services.llm.anthropic_llm import AnthropicLlm
-from speedoflight.services.llm.base_llm import BaseLlmService
+from speedoflight.services.llm.base_llm import BaseLlmService, DeltaCallback
+from speedoflight.services.llm.cascade_policy import CascadePolicy
+from speedoflight.services.llm.cassette_llm import CassetteLlm
+from speedoflight.services.llm.context_budget import ContextBudget
+from speedoflight.services.llm.http_pool import HttpPool
 from speedoflight.services.llm.ollama_llm import OllamaLlm
+from speedoflight.services.llm.retry_policy import RetryPolicy
+from speedoflight.utils import generate_uuid
+
+LLMConfigT = TypeVar("LLMConfigT", bound=BaseLLMConfig)
 
 
 class LlmService(BaseService):
+    __gsignals__ = {
+        LLM_STATUS_SIGNAL: (GObject.SignalFlags.RUN_FIRST, None, (str,)),
+    }
+
     def __init__(self, configuration: ConfigurationService, desktop: DesktopService):
         super().__init__(service_name="llm")
         self._configuration = configuration
         self._desktop = desktop
-        self._client = self._create_llm_client()
+        self._http_pool = HttpPool(configuration.config.http)
+
+        # The configured provider first, followed by its fallbacks
+        routing = configuration.config.routing
+        providers = dict.fromkeys([configuration.config.llm] + routing.fallbacks)
+        cassette = configuration.config.cassette
+        if cassette is None:
+            self._clients = [self._create_llm_client(p) for p in providers]
+        else:
+            # Runs must be reproducible, so without failover. When replaying,
+            # the provider only lends its settings (e.g. its context budget),
+            # it sends no requests and needs no credentials.
+            offline = cassette.mode == CassetteMode.REPLAY
+            client = self._create_llm_client(configuration.config.llm, offline=offline)
+            self._clients = [CassetteLlm(cassette, client)]
+        self._client = self._clients[0]
+        self._hedge_delay = routing.hedge_delay
+
+        # A cheaper model for the routine iterations
+        cascade = configuration.config.cascade
+        self._cascade_client: Optional[BaseLlmService] = None
+        self._cascade_policy: Optional[CascadePolicy] = None
+        if cascade.provider is not None and cassette is None:
+            self._cascade_client = self._create_llm_client(
+                cascade.provider, model=cascade.model, pricing=cascade.pricing
+            )
+            self._cascade_policy = CascadePolicy(cascade)
+
+        # Summarizes the history, the configured model unless overridden
+        compaction = configuration.config.compaction
+        self._compaction_client = self._client
+        if compaction.provider is not None or compaction.model is not None:
+            if cassette is None:
+                self._compaction_client = self._create_llm_client(
+                    compaction.provider or configuration.config.llm,
+                    model=compaction.model,
+                    pricing=compaction.pricing,
+                )
+
+        self._all_clients = list(
+            dict.fromkeys(
+                self._clients
+                + ([self._cascade_client] if self._cascade_client else [])
+                + [self._compaction_client]
+            )
+        )
+        self._retry_policy = RetryPolicy(configuration.config.retry)
+        self._context_budgets = {
+            client: ContextBudget(configuration.config.context)
+            for client in self._all_clients
+        }
+        for client in self._all_clients:
+            asyncio.create_task(self._prepare(client))
         self._logger.info("Initialized.")
 
-    def _create_llm_client(self) -> BaseLlmService:
-        """Create the appropriate LLM client based on configuration."""
-        provider_key = self._configuration.config.llm.value
+    def _create_llm_client(
+        self,
+        provider: LLMProvider,
+        model: Optional[str] = None,
+        pricing: Optional[Pricing] = None,
+        offline: bool = False,
+    ) -> BaseLlmService:
+        """Create the appropriate LLM client based on configuration, the
+        model and its pricing can be overridden (e.g. for the cascade)."""
         base_config = (
-            self._configuration.config.llms.get(provider_key, None)
+            self._configuration.config.llms.get(provider.value, None)
             if self._configuration.config.llms
             else None
         )
 
         # Provider selection
-        if self._configuration.config.llm == LLMProvider.ANTHROPIC:
+        if provider == LLMProvider.ANTHROPIC:
             llm_config = (
                 base_config
                 if isinstance(base_config, AnthropicConfig)
                 else AnthropicConfig(api_key=os.getenv("ANTHROPIC_API_KEY", ""))
             )
-            return AnthropicLlm(llm_config, self._desktop)
+            llm_config = self._override_config(llm_config, model, pricing)
+            return AnthropicLlm(
+                llm_config, self._desktop, self._http_pool, offline=offline
+            )
         else:
             llm_config = (  # Default to Ollama
                 base_config if isinstance(base_config, OllamaConfig) else OllamaConfig()
             )
-            return OllamaLlm(llm_config)
+            llm_config = self._override_config(llm_config, model, pricing)
+            return OllamaLlm(llm_config, self._http_pool)
+
+    def _override_config(
+        self, config: LLMConfigT, model: Optional[str], pricing: Optional[Pricing]
+    ) -> LLMConfigT:
+        update: dict[str, Any] = {}
+        if model is not None and model != config.model:
+            # The configured pricing is for another model
+            if pricing is None and config.pricing != Pricing():
+                raise ValueError(f"Set the pricing of {model}.")
+            update["model"] = model
+        if pricing is not None:
+            update["pricing"] = pricing
+        return config.model_copy(update=update) if update else config
 
     async def generate_message(
         self,
         app_messages: list[BaseMessage],
         tools: list[types.Tool],
+        on_delta: Optional[DeltaCallback] = None,
+    ) -> ResponseMessage:
+        # All attempts share the same message ID, so that the UI replaces the
+        # partial content of a failed attempt instead of showing it twice.
+        message_id = generate_uuid()
+        streamed = False
+
+        def forward_delta(delta: ResponseDelta):
+            nonlocal streamed
+            streamed = True
+            if on_delta is not None:
+                on_delta(delta.model_copy(update={"message_id": message_id}))
+
+        def reset_stream():
+            nonlocal streamed
+            if streamed and on_delta is not None:
+                on_delta(
+                    ResponseDelta(message_id=message_id, index=0, type=DeltaType.RESET)
+                )
+            streamed = False
+
+        forward = forward_delta if on_delta else None
+
+        # Routine iterations go to the cheaper model first, which escalates
+        # to the configured one unless it answers with a tool use.
+        routine = self._is_routine(app_messages)
+        escalated_from: Optional[ResponseMessage] = None
+        if routine and self._cascade_client is not None:
+            client = self._cascade_client
+            try:
+                message = await self._generate(client, app_messages, tools, forward)
+                if message.stop_reason == StopReason.TOOL_USE:
+                    message.id = message_id
+                    self._record_cascade(routine=True)
+                    return message
+                self._logger.info(
+                    f"Escalating, {message.model} stopped with {message.stop_reason}."
+                )
+                escalated_from = message
+            except Exception as e:
+                self._logger.warning(f"Escalating, {client.service_name} failed: {e}")
+            reset_stream()
+        self._record_cascade(routine=False)
+
+        # Only the last provider retries transient errors, the others fail
+        # over right away, which is faster than waiting for them to recover.
+        for index, client in enumerate(self._clients):
+            fallback = (
+                self._clients[index + 1] if index + 1 < len(self._clients) else None
+            )
+            try:
+                if fallback is None:
+                    message = await self._generate_with_retries(
+                        client, app_messages, tools, forward, reset_stream
+                    )
+                elif index == 0 and self._hedge_delay is not None:
+                    message = await self._generate_hedged(
+                        client, fallback, app_messages, tools, forward
+                    )
+                else:
+                    message = await self._generate(client, app_messages, tools, forward)
+                message.id = message_id
+                message.escalated_from = escalated_from
+                return message
+            except Exception as e:
+                if fallback is None:
+                    raise
+                self._logger.warning(
+                    f"Request to {client.service_name} failed, "
+                    f"switching to {fallback.service_name}: {e}"
+                )
+                self.safe_emit(
+                    LLM_STATUS_SIGNAL,
+                    f"{client.service_name} failed, "
+                    f"switching to {fallback.service_name}.",
+                )
+                reset_stream()
+
+        raise RuntimeError("No LLM provider is configured.")
+
+    async def generate_summary(
+        self, app_messages: list[BaseMessage]
+    ) -> ResponseMessage:
+        """Generate a message without tools with the compaction model, e.g.
+        a summary of the history. Runs in the background, so without retries
+        or status updates."""
+        return await self._generate(self._compaction_client, app_messages, [], None)
+
+    def _is_routine(self, app_messages: list[BaseMessage]) -> bool:
+        if self._cascade_policy is None:
+            return False
+        return self._cascade_policy.is_routine(app_messages)
+
+    def _record_cascade(self, routine: bool):
+        if self._cascade_policy is not None:
+            self._cascade_policy.record(routine)
+
+    async def _generate(
+        self,
+        client: BaseLlmService,
+        messages: list[BaseMessage],
+        tools: list[types.Tool],
+        on_delta: Optional[DeltaCallback],
+    ) -> ResponseMessage:
+        """Send the request to the client once, within its context window."""
+        context_budget = self._context_budgets[client]
+        window = await context_budget.fit(client, messages, tools)
+        if len(window) < len(messages):
+            self.safe_emit(
+                LLM_STATUS_SIGNAL,
+                f"Left out {len(messages) - len(window)} older messages "
+                "to fit the context window.",
+            )
+        tokens = context_budget.estimate_ceiling(window, tools)
+        client.size_context(tokens)
+
+        await self._wait_for_rate_limits(client)
+        started_at = time.monotonic()
+        first_delta_at: Optional[float] = None
+
+        def timed_delta(delta: ResponseDelta):
+            nonlocal first_delta_at
+            if first_delta_at is None:
+                first_delta_at = time.monotonic()
+            if on_delta is not None:
+                on_delta(delta)
+
+        message = await client.generate_message(
+            window, tools, timed_delta if on_delta else None
+        )
+        message.latency = time.monotonic() - started_at
+        if first_delta_at is not None:
+            message.time_to_first_byte = first_delta_at - started_at
+        usage = message.usage
+        if usage is not None:
+            message.cost = client.get_cost(usage)
+            # Otherwise the estimates would be calibrated too low, e.g. Ollama
+            if client.counts_cached_tokens:
+                context_budget.record_usage(window, tools, usage)
+                tokens = (
+                    (usage.input_tokens or 0)
+                    + (usage.cache_read_tokens or 0)
+                    + (usage.cache_write_tokens or 0)
+                )
+        message.context_tokens = tokens
+        return message
+
+    async def _generate_with_retries(
+        self,
+        client: BaseLlmService,
+        messages: list[BaseMessage],
+        tools: list[types.Tool],
+        on_delta: Optional[DeltaCallback],
+        reset_stream: Callable[[], None],
     ) -> ResponseMessage:
-        return await self._client.generate_message(app_messages, tools)
+        started_at = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return await self._generate(client, messages, tools, on_delta)
+            except Exception as e:
+                transient = client.classify_error(e)
+                if transient is None:
+                    raise
+
+                delay = self._retry_policy.get_delay(attempt, transient.retry_after)
+                elapsed = time.monotonic() - started_at
+                if elapsed + delay > self._retry_policy.deadline:
+                    self._logger.error(f"Giving up after {attempt} attempts: {e}")
+                    raise
+
+                # Other requests sharing the same limits should also hold off
+                rate_limiter = client.rate_limiter
+                if transient.retry_after is not None and rate_limiter is not None:
+                    rate_limiter.block_for(transient.retry_after)
+
+                reset_stream()
+                self._logger.warning(
+                    f"Transient error ({transient.reason}) on attempt {attempt}, "
+                    f"retrying in {delay:.2f} seconds: {e}"
+                )
+                self.safe_emit(
+                    LLM_STATUS_SIGNAL,
+                    f"{transient.reason}, retrying in {delay:.1f} seconds "
+                    f"(attempt {attempt + 1}).",
+                )
+                await asyncio.sleep(delay)
+
+    async def _generate_hedged(
+        self,
+        primary: BaseLlmService,
+        backup: BaseLlmService,
+        messages: list[BaseMessage],
+        tools: list[types.Tool],
+        on_delta: Optional[DeltaCallback],
+    ) -> ResponseMessage:
+        """Send the request to the backup as well when the primary has not
+        started answering in time. The first one to stream (or to complete,
+        without streaming) is kept and the other one is cancelled."""
+        tasks: dict[str, asyncio.Task[ResponseMessage]] = {}
+        first: Optional[str] = None
+        answered = asyncio.Event()
+
+        def gate(name: str) -> Optional[DeltaCallback]:
+            if on_delta is None:
+                return None
+
+            def forward_delta(delta: ResponseDelta):
+                nonlocal first
+                if first is None:
+                    first = name
+                    answered.set()
+                    for other, task in tasks.items():
+                        if other != name:
+                            task.cancel()
+                if first == name and on_delta is not None:
+                    on_delta(delta)
+
+            return forward_delta
+
+        def start(client: BaseLlmService):
+            gated = gate(client.service_name)
+            tasks[client.service_name] = asyncio.create_task(
+                self._generate(client, messages, tools, gated)
+            )
+
+        start(primary)
+        primary_task = tasks[primary.service_name]
+        answered_task = asyncio.create_task(answered.wait())
+        try:
+            await asyncio.wait(
+                [primary_task, answered_task],
+                timeout=self._hedge_delay,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if primary_task.done() or answered.is_set():
+                return await primary_task
+
+            self._logger.info(
+                f"No answer from {primary.service_name} after {self._hedge_delay} "
+                f"seconds, also asking {backup.service_name}."
+            )
+            self.safe_emit(
+                LLM_STATUS_SIGNAL,
+                f"{primary.service_name} is slow, also asking {backup.service_name}.",
+            )
+            start(backup)
+
+            error: Optional[BaseException] = None
+            pending = set(tasks.values())
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.cancelled():
+                        continue
+                    if task.exception() is None:
+                        for other in pending:
+                            other.cancel()
+                        return task.result()
+                    error = task.exception()
+            raise error or RuntimeError("Both hedged requests were cancelled.")
+        finally:
+            # Also when the run is stopped, e.g. to close both HTTP requests
+            answered_task.cancel()
+            for task in tasks.values():
+                task.cancel()
+
+    async def _prepare(self, client: BaseLlmService) -> None:
+        try:
+            if self._configuration.config.http.prewarm:
+                await client.prewarm(self._on_prewarm_status)
+                self._logger.info(f"Connected to {client.service_name}.")
+            await client.preload(self._on_prewarm_status)
+        except Exception as e:
+            # Not fatal, the first request will connect (or fail) anyway
+            self._logger.warning(f"Unable to connect to {client.service_name}: {e}")
+            self.safe_emit(
+                LLM_STATUS_SIGNAL, f"Unable to connect to {client.service_name}: {e}"
+            )
+
+    def _on_prewarm_status(self, status: str):
+        self._logger.info(status)
+        self.safe_emit(LLM_STATUS_SIGNAL, status)
+
+    async def _wait_for_rate_limits(self, client: BaseLlmService) -> None:
+        """Delay the request if the provider's rate limits, as last reported,
+        would otherwise reject it with a 429."""
+        rate_limiter = client.rate_limiter
+        if rate_limiter is None:
+            return
+
+        delay = rate_limiter.reserve()
+        if delay <= 0:
+            return
+
+        self._logger.info(f"Pacing request for {delay:.2f} seconds.")
+        self.safe_emit(
+            LLM_STATUS_SIGNAL,
+            f"Waiting {delay:.0f} seconds to stay within the rate limits.",
+        )
+        await asyncio.sleep(delay)
+
+    @property
+    def client(self) -> BaseLlmService:
+        """The configured provider, without its fallbacks."""
+        return self._client
+
+    @property
+    def http_pool(self) -> HttpPool:
+        """Shared by the LLM clients, and any other client of the same hosts."""
+        return self._http_pool
+
+    @property
+    def rate_limit_status(self) -> Optional[str]:
+        """Summary of the provider's rate limits, if it reports them."""
+        rate_limiter = self._client.rate_limiter
+        return rate_limiter.get_status() if rate_limiter else None
 
     def shutdown(self):
-        pass
+        for client in self._all_clients:
+            client.shutdown()
+        asyncio.create_task(self._http_pool.aclose())
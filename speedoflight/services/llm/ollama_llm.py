@@ -1,4 +1,6 @@
-from typing import Any, Mapping, Sequence
+import asyncio
+import time
+from typing import Any, AsyncIterator, Mapping, Optional, Sequence
 
 from mcp import types
 from ollama import (
@@ -7,66 +9,297 @@ from ollama import (
     ListResponse,
     Message,
     Options,
+    ResponseError,
     ShowResponse,
 )
 
 from speedoflight.models import (
     BaseMessage,
+    DeltaType,
     MessageRole,
     OllamaConfig,
+    Pricing,
     RequestMessage,
+    ResponseDelta,
     ResponseMessage,
     StopReason,
     TextBlockRequest,
     TextBlockResponse,
     ThinkingBlockResponse,
+    ThinkingMode,
     ToolEnvironment,
     ToolImageOutputRequest,
     ToolInputResponse,
     ToolTextOutputRequest,
     Usage,
 )
-from speedoflight.services.llm.base_llm import BaseLlmService
+from speedoflight.services.llm.base_llm import (
+    BaseLlmService,
+    DeltaCallback,
+    StatusCallback,
+)
+from speedoflight.services.llm.http_pool import HttpPool
+from speedoflight.services.llm.retry_policy import TransientError
+from speedoflight.services.llm.thinking_policy import ThinkingPolicy
 from speedoflight.utils import generate_uuid
 
+# Ollama streams thinking, content and tool calls as separate fields of each
+# chunk, we map them to fixed content block indexes for the UI.
+THINKING_BLOCK_INDEX = 0
+CONTENT_BLOCK_INDEX = 1
+TOOL_CALLS_BLOCK_INDEX = 2
+
+# Part of the context window kept free for the response.
+OUTPUT_TOKENS_RESERVE = 2048
+
+# The context window (`num_ctx`) starts at this size and doubles as the
+# conversation grows, up to the configured maximum. It never shrinks, since
+# Ollama reloads the model whenever it changes.
+INITIAL_NUM_CTX = 8192
+
+MIN_REFRESH_INTERVAL = 60.0  # seconds
+
 
 class OllamaLlm(BaseLlmService):
-    def __init__(self, config: OllamaConfig):
+    def __init__(self, config: OllamaConfig, http_pool: HttpPool):
         super().__init__(service_name="ollama")
         self._config = config
         self._logger.info(f"Using Ollama config: {config}")
-        self._client = AsyncClient(host=config.host)
+        # The Ollama client creates its own httpx client, which is then
+        # layered on top of the shared connections.
+        self._client = AsyncClient(host=config.host, transport=http_pool.transport)
+        self._thinking_policy = ThinkingPolicy(config.thinking_mode)
+        self._num_ctx = min(INITIAL_NUM_CTX, config.context_window)
+        self._model_context_length: Optional[int] = None
+        self._system_message: Optional[Message] = None
+        self._residency_task: Optional[asyncio.Task] = None
         # asyncio.create_task(self.list_compatible_models())
 
     async def generate_message(
         self,
         app_messages: list[BaseMessage],
         tools: list[types.Tool],
+        on_delta: Optional[DeltaCallback] = None,
     ) -> ResponseMessage:
-        system_message = Message(role="system", content=self._get_system_prompt())
-        messages = [self.to_native(msg) for msg in app_messages]
-        native_tools: Sequence[Mapping[str, Any]] = [
-            {
-                "type": "function",
-                "function": {
-                    "name": tool.name,
-                    "description": tool.description,
-                    "parameters": tool.inputSchema,
-                },
+        system_message = self._get_system_message()
+        messages = self._flatten(self.to_native_messages(app_messages))
+        native_tools = self.get_native_tools(tools)
+
+        think = self._thinking_policy.should_think(app_messages)
+        message_id = generate_uuid()
+        options = self._get_options()
+        if self._config.enable_streaming:
+            stream: AsyncIterator[ChatResponse] = await self._client.chat(
+                model=self._config.model,
+                options=options,
+                messages=[system_message] + messages,
+                tools=native_tools,
+                think=think,
+                keep_alive=self._config.keep_alive,
+                stream=True,
+            )
+            result = await self._accumulate_stream(message_id, stream, on_delta)
+        else:
+            result: ChatResponse = await self._client.chat(
+                model=self._config.model,
+                options=options,
+                messages=[system_message] + messages,
+                tools=native_tools,
+                think=think,
+                keep_alive=self._config.keep_alive,
+            )
+
+        self._logger.debug(f"Generated message: {result}")
+        response = self.from_native(result)
+        response.id = message_id
+        return response
+
+    async def _accumulate_stream(
+        self,
+        message_id: str,
+        stream: AsyncIterator[ChatResponse],
+        on_delta: Optional[DeltaCallback],
+    ) -> ChatResponse:
+        """Consume the stream, forwarding deltas as they arrive, and combine
+        all chunks into a single response equivalent to a non-streamed one."""
+        thinking: list[str] = []
+        content: list[str] = []
+        tool_calls: list[Message.ToolCall] = []
+        last_chunk: ChatResponse | None = None
+        async for chunk in stream:
+            last_chunk = chunk
+            if chunk.message.thinking:
+                thinking.append(chunk.message.thinking)
+                self._emit_delta(
+                    on_delta,
+                    ResponseDelta(
+                        message_id=message_id,
+                        index=THINKING_BLOCK_INDEX,
+                        type=DeltaType.THINKING,
+                        text=chunk.message.thinking,
+                    ),
+                )
+            if chunk.message.content:
+                content.append(chunk.message.content)
+                self._emit_delta(
+                    on_delta,
+                    ResponseDelta(
+                        message_id=message_id,
+                        index=CONTENT_BLOCK_INDEX,
+                        type=DeltaType.TEXT,
+                        text=chunk.message.content,
+                    ),
+                )
+            for tool_call in chunk.message.tool_calls or []:
+                # Tool calls are not streamed in pieces, they arrive complete
+                for delta_type in [DeltaType.TOOL_INPUT, DeltaType.TOOL_INPUT_END]:
+                    self._emit_delta(
+                        on_delta,
+                        ResponseDelta(
+                            message_id=message_id,
+                            index=TOOL_CALLS_BLOCK_INDEX + len(tool_calls),
+                            type=delta_type,
+                            name=tool_call.function.name,
+                            arguments=dict(tool_call.function.arguments),
+                        ),
+                    )
+                tool_calls.append(tool_call)
+
+        if last_chunk is None:
+            raise RuntimeError("Ollama returned an empty stream.")
+
+        # The last chunk carries the stats (e.g. usage) and the done reason
+        return last_chunk.model_copy(
+            update={
+                "message": Message(
+                    role=last_chunk.message.role,
+                    content="".join(content),
+                    thinking="".join(thinking) or None,
+                    tool_calls=tool_calls or None,
+                )
             }
-            for tool in tools
-        ]
+        )
+
+    def _emit_delta(self, on_delta: Optional[DeltaCallback], delta: ResponseDelta):
+        if on_delta is not None:
+            on_delta(delta)
+
+    def _get_system_message(self) -> Message:
+        # Ollama reuses its cache for the longest common prefix of the prompt,
+        # which starts with the system prompt and the tools. Both must stay
+        # byte-identical between requests, so the date in the system prompt is
+        # not updated during the session.
+        if self._system_message is None:
+            self._system_message = Message(
+                role="system", content=self._get_system_prompt()
+            )
+        return self._system_message
 
-        result: ChatResponse = await self._client.chat(
+    @property
+    def pricing(self) -> Optional[Pricing]:
+        return self._config.pricing
+
+    @property
+    def counts_cached_tokens(self) -> bool:
+        # `prompt_eval_count` leaves out the prefix reused from the KV cache
+        return False
+
+    async def prewarm(self, on_status: StatusCallback) -> None:
+        await self._client.ps()
+
+    async def preload(self, on_status: StatusCallback) -> None:
+        if not self._config.preload_model:
+            return
+
+        # Big models take a while to load, which would otherwise delay the
+        # first message.
+        model = self._config.model
+        await self._check_capabilities(on_status)
+        on_status(f"Loading {model}.")
+        started_at = time.monotonic()
+        await self._load_model()
+        elapsed = time.monotonic() - started_at
+        on_status(f"Loaded {model} in {elapsed:.0f} seconds.")
+
+        if self._config.keep_alive > 0 and self._residency_task is None:
+            self._residency_task = asyncio.create_task(self._refresh_residency())
+
+    async def _check_capabilities(self, on_status: StatusCallback) -> None:
+        model = self._config.model
+        show: ShowResponse = await self._client.show(model)
+        capabilities = show.capabilities or []
+        if "tools" not in capabilities:
+            on_status(f"{model} does not support tools, they will not work.")
+        if "thinking" not in capabilities:
+            # Ollama rejects thinking requests for these models
+            self._logger.warning(f"{model} does not support thinking, disabling it.")
+            self._thinking_policy = ThinkingPolicy(ThinkingMode.OFF)
+
+        # The key is prefixed with the architecture, e.g. llama.context_length
+        for key, value in (show.modelinfo or {}).items():
+            if key.endswith(".context_length") and isinstance(value, int):
+                self._model_context_length = value
+                self._num_ctx = min(self._num_ctx, self._get_max_num_ctx())
+
+    async def _load_model(self) -> None:
+        # A request without a prompt only loads the model. The options must
+        # match the chat requests, e.g. a different num_ctx reloads the model.
+        await self._client.generate(
             model=self._config.model,
-            options=Options(temperature=self._config.temperature),
-            messages=[system_message] + messages,
-            tools=native_tools,
-            think=True,
+            options=self._get_options(),
+            keep_alive=self._config.keep_alive,
         )
 
-        self._logger.debug(f"Generated message: {result}")
-        return self.from_native(result)
+    async def _refresh_residency(self) -> None:
+        """Every request resets the keep alive timer of the model, we send
+        one regularly so that the model is not unloaded between messages."""
+        interval = max(MIN_REFRESH_INTERVAL, self._config.keep_alive / 2)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._load_model()
+                self._logger.debug(f"Refreshed residency of {self._config.model}.")
+            except Exception as e:
+                self._logger.warning(f"Failed to refresh model residency: {e}")
+
+    def shutdown(self):
+        if self._residency_task is not None:
+            self._residency_task.cancel()
+            self._residency_task = None
+
+    def _get_options(self) -> Options:
+        # Without num_ctx, Ollama silently truncates the prompt to the
+        # model's default context length.
+        return Options(temperature=self._config.temperature, num_ctx=self._num_ctx)
+
+    def _get_max_num_ctx(self) -> int:
+        if self._model_context_length is None:
+            return self._config.context_window
+        return min(self._config.context_window, self._model_context_length)
+
+    def size_context(self, tokens: int) -> None:
+        # The output shares the context window with the prompt
+        needed = tokens + OUTPUT_TOKENS_RESERVE
+        max_num_ctx = self._get_max_num_ctx()
+        num_ctx = self._num_ctx
+        while num_ctx < needed and num_ctx < max_num_ctx:
+            num_ctx = min(num_ctx * 2, max_num_ctx)
+        if num_ctx != self._num_ctx:
+            self._logger.info(f"Growing num_ctx from {self._num_ctx} to {num_ctx}.")
+            self._num_ctx = num_ctx
+
+    def get_context_budget(self) -> int:
+        return self._get_max_num_ctx() - OUTPUT_TOKENS_RESERVE
+
+    def classify_error(self, error: Exception) -> Optional[TransientError]:
+        # Ollama answers with a 503 when its request queue is full, and a 500
+        # e.g. when the model runner crashed while loading.
+        if isinstance(error, ResponseError):
+            status_code = error.status_code
+            if status_code in [408, 429] or status_code >= 500:
+                return TransientError(reason=f"{error.error} ({status_code})")
+            return None
+        return super().classify_error(error)
 
     async def list_compatible_models(self):
         models: ListResponse = await self._client.list()
@@ -82,12 +315,41 @@ class OllamaLlm(BaseLlmService):
             if has_tools and has_thinking:
                 self._logger.info(f"- Compatible model: {model_name}")
 
-    def to_native(self, app_msg: BaseMessage) -> Mapping[str, Any] | Message:
-        if isinstance(app_msg, ResponseMessage) and app_msg.raw is not None:
-            return Message(
-                role=app_msg.raw.message.role,
-                content=app_msg.raw.message.content,
-            )
+    def to_native_tools(self, tools: list[types.Tool]) -> Sequence[Mapping[str, Any]]:
+        return [
+            {
+                "type": "function",
+                "function": {
+                    "name": tool.name,
+                    "description": tool.description,
+                    "parameters": tool.inputSchema,
+                },
+            }
+            for tool in tools
+        ]
+
+    def _flatten(self, native_messages: list[Any]) -> list[Mapping[str, Any] | Message]:
+        result = []
+        for native_msg in native_messages:
+            if isinstance(native_msg, list):
+                result.extend(native_msg)
+            else:
+                result.append(native_msg)
+        return result
+
+    def to_native(
+        self, app_msg: BaseMessage
+    ) -> Mapping[str, Any] | Message | list[Mapping[str, Any] | Message]:
+        if isinstance(app_msg, ResponseMessage):
+            if app_msg.raw is not None and app_msg.provider == self.service_name:
+                # Keep the tool calls, so that the message renders as it was
+                # generated and the cached prefix still matches.
+                return Message(
+                    role=app_msg.raw.message.role,
+                    content=app_msg.raw.message.content,
+                    tool_calls=app_msg.raw.message.tool_calls,
+                )
+            return self._response_to_native(app_msg)
 
         if app_msg.role == MessageRole.HUMAN:
             role = "user"
@@ -97,12 +359,14 @@ class OllamaLlm(BaseLlmService):
             raise ValueError(f"Unsupported message role: {app_msg.role}")
 
         content = app_msg.content if isinstance(app_msg, RequestMessage) else []
+        if role == "tool" and len(content) > 1:
+            # The results of parallel tool calls, one native message each
+            return [self._block_to_native(role, block) for block in content]
         if len(content) != 1:
-            # TODO: Do we need to convert the application message into
-            # multiple native messages in this situation?
             self._logger.warning("Only one content block is supported in Ollama.")
+        return self._block_to_native(role, next(iter(content), None))
 
-        block = next(iter(content), None)
+    def _block_to_native(self, role: str, block: Any) -> Mapping[str, Any] | Message:
         if isinstance(block, TextBlockRequest):
             return Message(role=role, content=block.text)
         elif isinstance(block, ToolTextOutputRequest):
@@ -118,6 +382,26 @@ class OllamaLlm(BaseLlmService):
         else:
             raise ValueError(f"Unsupported application block type: {type(block)}")
 
+    def _response_to_native(self, app_msg: ResponseMessage) -> Message:
+        """Convert a message generated by another provider (e.g. after a
+        failover), only the text and the local tool uses carry over."""
+        text: list[str] = []
+        tool_calls: list[Message.ToolCall] = []
+        for block in app_msg.content:
+            if isinstance(block, TextBlockResponse):
+                text.append(block.text)
+            elif (
+                isinstance(block, ToolInputResponse)
+                and block.environment == ToolEnvironment.LOCAL
+            ):
+                function = Message.ToolCall.Function(
+                    name=block.name, arguments=block.arguments
+                )
+                tool_calls.append(Message.ToolCall(function=function))
+        return Message(
+            role="assistant", content="\n".join(text), tool_calls=tool_calls or None
+        )
+
     def from_native(self, native_msg: ChatResponse) -> ResponseMessage:
         stop_reason = StopReason.END_TURN
         if native_msg.done:
@@ -127,8 +411,9 @@ class OllamaLlm(BaseLlmService):
                     f"Unexpected done reason: {native_msg.done_reason}."
                 )
         else:
-            # It should always be done because we are not streaming results (yet?)
-            self._logger.warning("Message should be done, we are not streaming.")
+            # Streamed chunks are combined before conversion, so the message
+            # should always be done at this point.
+            self._logger.warning("Message should be done, was the stream cut short?")
 
         content = []
         if native_msg.message.thinking:
@@ -0,0 +1,145 @@
+"""
+
+Client-side pacing based on the rate limits reported by the provider.
+
+Providers like Anthropic use the token bucket algorithm: capacity is
+continuously replenished up to the limit, and the reset time is when the
+bucket will be full again. We mirror the buckets locally, so that requests
+that would be rejected with a 429 are delayed instead:
+https://docs.anthropic.com/en/api/rate-limits
+
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from pydantic import BaseModel
+
+from speedoflight.utils import get_now_utc
+
+BUCKET_REQUESTS = "requests"
+BUCKET_INPUT_TOKENS = "input_tokens"
+BUCKET_OUTPUT_TOKENS = "output_tokens"
+BUCKET_TOKENS = "tokens"
+
+# Limits are per minute, if the reset time is unusable we assume a full
+# bucket refills in this time.
+DEFAULT_REFILL_PERIOD = 60.0  # seconds
+
+# Upper bound for a single wait, in case the provider reports bogus values.
+MAX_DELAY = 60.0  # seconds
+
+
+class RateLimitBucket(BaseModel):
+    name: str
+    limit: int
+    remaining: float
+    reset: datetime
+    updated_at: datetime
+    refill_rate: float  # units per second
+
+    def available(self, at: datetime) -> float:
+        elapsed = max(0.0, (at - self.updated_at).total_seconds())
+        return min(float(self.limit), self.remaining + self.refill_rate * elapsed)
+
+    def delay_for(self, needed: float, now: datetime) -> float:
+        """Seconds until the bucket can accommodate the given amount."""
+        # Requests bigger than the whole bucket can only wait for a full one
+        needed = min(needed, float(self.limit))
+        missing = needed - self.available(now)
+        if missing <= 0:
+            return 0.0
+        return missing / self.refill_rate if self.refill_rate > 0 else MAX_DELAY
+
+    def consume(self, amount: float, now: datetime) -> None:
+        # Remaining can go negative, which makes the next callers wait longer.
+        self.remaining = self.available(now) - amount
+        self.updated_at = now
+
+
+class RateLimiter:
+    def __init__(self, name: str):
+        self._logger = logging.getLogger(f"{name}.rate_limiter")
+        self._buckets: dict[str, RateLimitBucket] = {}
+        self._blocked_until: Optional[datetime] = None
+
+        # The next request is estimated to be at least as big as the last one
+        # (the conversation only grows), which is a good enough proxy.
+        self._last_input_tokens = 0
+        self._last_output_tokens = 0
+
+    def update_bucket(
+        self, name: str, limit: int, remaining: int, reset: datetime
+    ) -> None:
+        """Replace the local state of a bucket with the provider's values."""
+        now = get_now_utc()
+        seconds_until_reset = (reset - now).total_seconds()
+        missing = limit - remaining
+        if missing > 0 and seconds_until_reset > 0:
+            refill_rate = missing / seconds_until_reset
+        else:
+            refill_rate = limit / DEFAULT_REFILL_PERIOD
+
+        self._buckets[name] = RateLimitBucket(
+            name=name,
+            limit=limit,
+            remaining=remaining,
+            reset=reset,
+            updated_at=now,
+            refill_rate=refill_rate,
+        )
+
+    def record_usage(self, input_tokens: int, output_tokens: int) -> None:
+        self._last_input_tokens = input_tokens
+        self._last_output_tokens = output_tokens
+
+    def block_for(self, seconds: float) -> None:
+        """Hold all requests for the given time (e.g. from `retry-after`)."""
+        blocked_until = get_now_utc() + timedelta(seconds=seconds)
+        if self._blocked_until is None or blocked_until > self._blocked_until:
+            self._blocked_until = blocked_until
+
+    def reserve(self) -> float:
+        """Book capacity for the next request and return how many seconds the
+        caller should wait before sending it. Because capacity is booked
+        immediately, concurrent callers are spread out instead of bursting."""
+        now = get_now_utc()
+        demand = {
+            BUCKET_REQUESTS: 1,
+            BUCKET_INPUT_TOKENS: self._last_input_tokens,
+            BUCKET_OUTPUT_TOKENS: self._last_output_tokens,
+            BUCKET_TOKENS: self._last_input_tokens + self._last_output_tokens,
+        }
+
+        delay = 0.0
+        if self._blocked_until is not None:
+            delay = max(0.0, (self._blocked_until - now).total_seconds())
+        for name, needed in demand.items():
+            bucket = self._buckets.get(name)
+            if bucket is not None:
+                delay = max(delay, bucket.delay_for(needed, now))
+
+        for name, needed in demand.items():
+            bucket = self._buckets.get(name)
+            if bucket is not None:
+                bucket.consume(needed, now)
+
+        return min(delay, MAX_DELAY)
+
+    def get_status(self) -> Optional[str]:
+        """Short summary of the most constrained bucket, for the usage label."""
+        now = get_now_utc()
+        lowest: Optional[tuple[float, RateLimitBucket]] = None
+        for bucket in self._buckets.values():
+            if bucket.limit <= 0:
+                continue
+            ratio = max(0.0, bucket.available(now)) / bucket.limit
+            if lowest is None or ratio < lowest[0]:
+                lowest = (ratio, bucket)
+
+        if lowest is None:
+            return None
+        ratio, bucket = lowest
+        name = bucket.name.replace("_", " ")
+        return f"{ratio * 100:.0f}% of {name} left"
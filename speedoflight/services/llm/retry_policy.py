@@ -0,0 +1,60 @@
+"""
+
+Retries for transient LLM failures (e.g. rate limited, overloaded, connection
+reset) using exponential backoff with jitter:
+https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+
+"""
+
+import random
+from typing import Optional
+
+import httpx
+from pydantic import BaseModel
+
+from speedoflight.models import RetryConfig
+
+HEADER_RETRY_AFTER = "retry-after"
+HEADER_RETRY_AFTER_MS = "retry-after-ms"
+
+
+class TransientError(BaseModel):
+    """An error that is worth retrying, as classified by each provider."""
+
+    reason: str
+    retry_after: Optional[float] = None  # seconds, as requested by the server
+
+
+def parse_retry_after(headers: httpx.Headers) -> Optional[float]:
+    """Parse the retry headers, only the delay-seconds format is supported."""
+    try:
+        retry_after_ms = headers.get(HEADER_RETRY_AFTER_MS)
+        if retry_after_ms is not None:
+            return float(retry_after_ms) / 1000
+        retry_after = headers.get(HEADER_RETRY_AFTER)
+        if retry_after is not None:
+            return float(retry_after)
+    except ValueError:
+        pass
+    return None
+
+
+class RetryPolicy:
+    def __init__(self, config: RetryConfig):
+        self._config = config
+
+    @property
+    def deadline(self) -> float:
+        return self._config.deadline
+
+    def get_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Delay before the given retry attempt (starting at 1). The jitter
+        keeps several clients that failed together from retrying together."""
+        backoff = min(
+            self._config.max_delay,
+            self._config.initial_delay * (2 ** (attempt - 1)),
+        )
+        delay = random.uniform(backoff / 2, backoff)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
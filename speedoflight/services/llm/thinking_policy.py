@@ -0,0 +1,65 @@
+"""
+
+Decides how much the LLM should think before answering, on each iteration.
+
+Thinking tokens are generated before anything else, so they add directly to
+the latency of every iteration. They pay off when the LLM has to plan a new
+request from the user, somewhat when it has to recover from a tool that
+failed, but much less on routine follow-ups like taking a screenshot after a
+click.
+
+"""
+
+from typing import Optional
+
+from speedoflight.models import (
+    BaseMessage,
+    MessageRole,
+    RequestMessage,
+    ThinkingMode,
+    ToolImageOutputRequest,
+    ToolTextOutputRequest,
+)
+
+# Share of the budget to recover from a failed tool, the plan is already there.
+RECOVERY_BUDGET_RATIO = 0.5
+
+
+class ThinkingPolicy:
+    def __init__(self, mode: ThinkingMode):
+        self._mode = mode
+
+    def should_think(self, app_messages: list[BaseMessage]) -> bool:
+        return self.get_budget(app_messages, budget=1) > 0
+
+    def get_budget(self, app_messages: list[BaseMessage], budget: int) -> int:
+        """Thinking tokens for the next iteration, out of the configured
+        budget, or 0 to skip thinking."""
+        if self._mode == ThinkingMode.OFF:
+            return 0
+        if self._mode == ThinkingMode.FIXED:
+            return budget
+
+        tool_results = self._get_tool_results(app_messages)
+        if tool_results is None:
+            return budget  # planning
+        if any(
+            isinstance(block, (ToolTextOutputRequest, ToolImageOutputRequest))
+            and block.is_error
+            for block in tool_results.content
+        ):
+            return max(1, int(budget * RECOVERY_BUDGET_RATIO))
+        return 0  # routine follow-up
+
+    def _get_tool_results(
+        self, app_messages: list[BaseMessage]
+    ) -> Optional[RequestMessage]:
+        """The last message, if it holds tool results."""
+        if not app_messages:
+            return None
+        last_message = app_messages[-1]
+        if not isinstance(last_message, RequestMessage):
+            return None
+        if last_message.role != MessageRole.TOOL:
+            return None
+        return last_message
@@ -185,6 +185,8 @@ class BaseServer(GObject.Object):
         while attempt < retries:
             try:
                 self._logger.info(f"Executing {tool_name}.")
+                # When cancelled, the session drops the request and ignores
+                # its late response, the server is not notified.
                 return await self._session.call_tool(tool_name, arguments)
             except Exception as e:
                 attempt += 1
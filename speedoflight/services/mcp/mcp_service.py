@@ -1,4 +1,5 @@
 import asyncio
+import time
 from typing import Any
 
 from mcp import types
@@ -34,9 +35,11 @@ class McpService(BaseService):
         self._configuration = configuration
         self._servers: dict[str, BaseServer] = {}
         self._tools: dict[str, list[types.Tool]] = {}
+        self._tools_version = 0
         self._resources: dict[str, list[types.Resource]] = {}
         self._resource_templates: dict[str, list[types.ResourceTemplate]] = {}
         self._prompts: dict[str, list[types.Prompt]] = {}
+        self._pending_servers: set[str] = set()
         self._initialize()
         self._logger.info("Initialized.")
 
@@ -44,6 +47,11 @@ class McpService(BaseService):
     def tools(self) -> dict[str, list[types.Tool]]:
         return self._tools
 
+    @property
+    def tools_version(self) -> int:
+        """Incremented every time the tools of any server change."""
+        return self._tools_version
+
     @property
     def resources(self) -> dict[str, list[types.Resource]]:
         return self._resources
@@ -89,6 +97,7 @@ class McpService(BaseService):
         for server in self._servers.values():
             server.connect(SERVER_INITIALIZED_SIGNAL, self._on_server_initialized)
             self._logger.info(f"Initializing {server.server_name} server.")
+            self._pending_servers.add(server.server_name)
             asyncio.create_task(server.initialize())
 
     def _on_server_initialized(self, server: BaseServer, server_name: str):
@@ -110,6 +119,17 @@ class McpService(BaseService):
             await self._query_resource_templates(server)
         if capabilities.prompts:
             await self._query_prompts(server)
+        self._pending_servers.discard(server_name)
+
+    async def wait_for_servers(self, timeout: float) -> None:
+        """Wait until all servers reported their features, e.g. before running
+        without a user. Servers that fail to initialize are waited for until
+        the timeout expires."""
+        deadline = time.monotonic() + timeout
+        while self._pending_servers and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self._pending_servers:
+            self._logger.warning(f"Servers not ready: {self._pending_servers}")
 
     def _filter_tools(
         self, server_name: str, tools: list[types.Tool]
@@ -134,6 +154,7 @@ class McpService(BaseService):
             if tools:
                 tools = self._filter_tools(server_name, tools)
                 self._tools[server_name] = tools
+                self._tools_version += 1
                 count = len(tools)
                 names = [tool.name for tool in tools]
                 self._logger.info(f"{server_name} has {count} tools enabled: {names}")
@@ -6,12 +6,16 @@ from speedoflight.constants import (
     AGENT_READY_SIGNAL,
     AGENT_RUN_COMPLETED_SIGNAL,
     AGENT_RUN_STARTED_SIGNAL,
+    AGENT_UPDATE_AI_DELTA_SIGNAL,
     AGENT_UPDATE_AI_SIGNAL,
+    AGENT_UPDATE_STATUS_SIGNAL,
     AGENT_UPDATE_TOOL_SIGNAL,
+    AGENT_UPDATE_USAGE_SIGNAL,
 )
 from speedoflight.models import (
     AgentRequest,
     AnthropicConfig,
+    BaseMessage,
     LLMProvider,
     MessageRole,
     RequestMessage,
@@ -28,7 +32,10 @@ from speedoflight.utils import generate_uuid
 class OrchestratorService(BaseService):
     __gsignals__ = {
         AGENT_UPDATE_AI_SIGNAL: (GObject.SignalFlags.RUN_FIRST, None, (str,)),
+        AGENT_UPDATE_AI_DELTA_SIGNAL: (GObject.SignalFlags.RUN_FIRST, None, (str,)),
         AGENT_UPDATE_TOOL_SIGNAL: (GObject.SignalFlags.RUN_FIRST, None, (str,)),
+        AGENT_UPDATE_STATUS_SIGNAL: (GObject.SignalFlags.RUN_FIRST, None, (str,)),
+        AGENT_UPDATE_USAGE_SIGNAL: (GObject.SignalFlags.RUN_FIRST, None, (str,)),
         AGENT_READY_SIGNAL: (GObject.SignalFlags.RUN_FIRST, None, ()),
         AGENT_RUN_STARTED_SIGNAL: (GObject.SignalFlags.RUN_FIRST, None, ()),
         AGENT_RUN_COMPLETED_SIGNAL: (GObject.SignalFlags.RUN_FIRST, None, (str,)),
@@ -44,7 +51,10 @@ class OrchestratorService(BaseService):
         self._configuration = configuration
         self._agent = agent
         self._agent.connect(AGENT_UPDATE_AI_SIGNAL, self._on_agent_update_ai)
+        self._agent.connect(AGENT_UPDATE_AI_DELTA_SIGNAL, self._on_agent_update_delta)
         self._agent.connect(AGENT_UPDATE_TOOL_SIGNAL, self._on_agent_update_tool)
+        self._agent.connect(AGENT_UPDATE_STATUS_SIGNAL, self._on_agent_update_status)
+        self._agent.connect(AGENT_UPDATE_USAGE_SIGNAL, self._on_agent_update_usage)
         self._agent.connect(AGENT_READY_SIGNAL, self._on_agent_ready)
         self._agent.connect(AGENT_RUN_STARTED_SIGNAL, self._on_agent_run_started)
         self._agent.connect(AGENT_RUN_COMPLETED_SIGNAL, self._on_agent_run_completed)
@@ -69,12 +79,42 @@ class OrchestratorService(BaseService):
             ),
         )
 
-        # TODO: Make the agent task cancellable from the UI
         self._agent_task = asyncio.create_task(self._agent.run(request))
         self._agent_task.add_done_callback(self._on_agent_task_done)
         self._logger.info("Agent task started.")
 
+    def resume_agent(self):
+        self._logger.info("Resuming agent.")
+        self._agent_task = asyncio.create_task(self._agent.resume())
+        self._agent_task.add_done_callback(self._on_agent_task_done)
+
+    def stop_agent(self):
+        """Cancel the running agent task, along with its LLM request and tool
+        calls. The agent reports the run as completed."""
+        if self._agent_task is None or self._agent_task.done():
+            return
+        self._logger.info("Stopping agent.")
+        self._agent_task.cancel()
+
+    def restore_session(self, session_id: str) -> bool:
+        """Continue a stored session instead of the new one."""
+        if not self._agent.restore_session(session_id):
+            return False
+        self._session_id = session_id
+        return True
+
+    @property
+    def can_resume(self) -> bool:
+        return self._agent.can_resume
+
+    @property
+    def messages(self) -> list[BaseMessage]:
+        return self._agent.messages
+
     def _on_agent_task_done(self, future: asyncio.Future):
+        if future.cancelled():
+            self._logger.info("Agent execution cancelled.")
+            return
         try:
             future.result()
             self._logger.info("Agent execution completed.")
@@ -85,10 +125,21 @@ class OrchestratorService(BaseService):
         self._logger.info("Emitting AI message.")
         self.safe_emit(AGENT_UPDATE_AI_SIGNAL, encoded_message)
 
+    def _on_agent_update_delta(self, agent_service, encoded_delta: str):
+        # Not logged, there can be hundreds of these per message
+        self.safe_emit(AGENT_UPDATE_AI_DELTA_SIGNAL, encoded_delta)
+
     def _on_agent_update_tool(self, agent_service, encoded_message: str):
         self._logger.info("Emitting tool message.")
         self.safe_emit(AGENT_UPDATE_TOOL_SIGNAL, encoded_message)
 
+    def _on_agent_update_status(self, agent_service, status: str):
+        self._logger.info(f"Agent status: {status}")
+        self.safe_emit(AGENT_UPDATE_STATUS_SIGNAL, status)
+
+    def _on_agent_update_usage(self, agent_service, encoded_update: str):
+        self.safe_emit(AGENT_UPDATE_USAGE_SIGNAL, encoded_update)
+
     def _on_agent_ready(self, agent_service):
         self._logger.info("Agent is ready.")
         self.safe_emit(AGENT_READY_SIGNAL)
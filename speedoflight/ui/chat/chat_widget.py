@@ -15,6 +15,10 @@ class ChatWidget(Gtk.ListView):
         self.store = Gio.ListStore(item_type=GBaseMessage)
         self.store.connect("items-changed", self._on_items_changed)
 
+        # Messages that were already revealed once (e.g. streamed responses
+        # that are re-rendered as they grow) skip the reveal transition.
+        self._revealed_ids: set[str] = set()
+
         selection_model = Gtk.NoSelection(model=self.store)
         super().__init__(model=selection_model)
 
@@ -65,15 +69,41 @@ class ChatWidget(Gtk.ListView):
 
         # Wrap it in a revealer
         revealer = Gtk.Revealer()
+        revealer.set_child(message_widget)
+        list_item.set_child(revealer)
+        if message.data.id in self._revealed_ids:
+            revealer.set_transition_type(Gtk.RevealerTransitionType.NONE)
+            revealer.set_reveal_child(True)
+            return
+
+        self._revealed_ids.add(message.data.id)
         revealer.set_reveal_child(False)
         revealer.set_transition_type(Gtk.RevealerTransitionType.CROSSFADE)
         revealer.set_transition_duration(500)
-        revealer.set_child(message_widget)
-        list_item.set_child(revealer)
         GLib.idle_add(revealer.set_reveal_child, True)
 
     def add_message(self, message: GBaseMessage):
         self.store.append(message)
 
+    def update_message(self, message: GBaseMessage):
+        """Replace the message with the same ID (e.g. a partial response that
+        is being streamed), or append it if it is not in the list yet."""
+        # Search backwards, the message being updated is usually the last one
+        for position in range(self.store.get_n_items() - 1, -1, -1):
+            item = self.store.get_item(position)
+            if isinstance(item, GBaseMessage) and item.data.id == message.data.id:
+                self.store.splice(position, 1, [message])
+                return
+        self.store.append(message)
+
+    def remove_message(self, message_id: str):
+        for position in range(self.store.get_n_items() - 1, -1, -1):
+            item = self.store.get_item(position)
+            if isinstance(item, GBaseMessage) and item.data.id == message_id:
+                self.store.remove(position)
+                self._revealed_ids.discard(message_id)
+                return
+
     def clear_messages(self):
         self.store.remove_all()
+        self._revealed_ids.clear()
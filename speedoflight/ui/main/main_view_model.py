@@ -1,24 +1,47 @@
 import random
 
-from gi.repository import GObject  # type: ignore
+from gi.repository import GLib, GObject  # type: ignore
 
 from speedoflight.constants import (
+    AGENT_DISCARD_AI_SIGNAL,
     AGENT_READY_SIGNAL,
     AGENT_RUN_COMPLETED_SIGNAL,
     AGENT_RUN_STARTED_SIGNAL,
+    AGENT_UPDATE_AI_DELTA_SIGNAL,
     AGENT_UPDATE_AI_SIGNAL,
     AGENT_UPDATE_SOL_SIGNAL,
+    AGENT_UPDATE_STATUS_SIGNAL,
     AGENT_UPDATE_TOOL_SIGNAL,
+    AGENT_UPDATE_USAGE_SIGNAL,
+)
+from speedoflight.models import (
+    AgentResponse,
+    BaseMessage,
+    DeltaType,
+    MessageRole,
+    ResponseDelta,
+    ResponseMessage,
+    TextBlockResponse,
+    ThinkingBlockResponse,
+    ToolEnvironment,
+    ToolInputResponse,
+    UsageUpdate,
 )
-from speedoflight.models import AgentResponse
 from speedoflight.services.orchestrator.orchestrator_service import OrchestratorService
 from speedoflight.ui.base_view_model import BaseViewModel
 from speedoflight.ui.main.agent_state import AgentState
 from speedoflight.ui.main.main_view_state import MainViewState
 
+# Streamed responses are re-rendered at most this often, rebuilding the
+# message widget for every single token would be too expensive.
+STREAMING_REFRESH_INTERVAL = 100  # milliseconds
+
+StreamingBlock = TextBlockResponse | ThinkingBlockResponse | ToolInputResponse
+
 
 class MainViewModel(BaseViewModel):
     __gsignals__ = {
+        AGENT_DISCARD_AI_SIGNAL: (GObject.SignalFlags.RUN_FIRST, None, (str,)),
         AGENT_UPDATE_AI_SIGNAL: (GObject.SignalFlags.RUN_FIRST, None, (str,)),
         AGENT_UPDATE_SOL_SIGNAL: (GObject.SignalFlags.RUN_FIRST, None, (str,)),
         AGENT_UPDATE_TOOL_SIGNAL: (GObject.SignalFlags.RUN_FIRST, None, (str,)),
@@ -47,7 +70,16 @@ class MainViewModel(BaseViewModel):
         self._orchestrator.connect(AGENT_RUN_STARTED_SIGNAL, self._on_agent_started)
         self._orchestrator.connect(AGENT_RUN_COMPLETED_SIGNAL, self._on_agent_completed)
         self._orchestrator.connect(AGENT_UPDATE_AI_SIGNAL, self._on_agent_update_ai)
+        self._orchestrator.connect(
+            AGENT_UPDATE_AI_DELTA_SIGNAL, self._on_agent_update_ai_delta
+        )
         self._orchestrator.connect(AGENT_UPDATE_TOOL_SIGNAL, self._on_agent_update_tool)
+        self._orchestrator.connect(
+            AGENT_UPDATE_STATUS_SIGNAL, self._on_agent_update_status
+        )
+        self._orchestrator.connect(
+            AGENT_UPDATE_USAGE_SIGNAL, self._on_agent_update_usage
+        )
 
         # Initialize computer use setting from configuration. In the future,
         # we might want to expose a more generic way to expose settings
@@ -55,6 +87,13 @@ class MainViewModel(BaseViewModel):
         self.view_state.enable_computer_use = (
             self._orchestrator.is_computer_use_enabled()
         )
+        self.view_state.can_resume = self._orchestrator.can_resume
+
+        # Partial content of the messages being streamed, by message ID and
+        # then by content block index.
+        self._streaming: dict[str, dict[int, StreamingBlock]] = {}
+        self._streaming_dirty: set[str] = set()
+        self._streaming_source_id: int | None = None
 
     def _on_agent_ready(self, _: OrchestratorService):
         self.view_state.status_text = "Ready."
@@ -66,13 +105,23 @@ class MainViewModel(BaseViewModel):
         self.view_state.agent_state = AgentState.RUNNING
         self.view_state.status_text = random.choice(self.AGENTIC_UPDATES)
         self.view_state.input_enabled = False
+        self.view_state.can_resume = False
         self.view_state.activity_mode = True
 
     def _on_agent_completed(self, _: OrchestratorService, encoded_message: str):
+        # Messages still streaming were stopped (or failed) before the end,
+        # they are not in the history.
+        for message_id in self._streaming:
+            self.emit(AGENT_DISCARD_AI_SIGNAL, message_id)
+        self._reset_streaming()
         self.view_state.agent_state = AgentState.COMPLETED
         self.view_state.input_enabled = True
         self.view_state.activity_mode = False
         response = AgentResponse.model_validate_json(encoded_message)
+        self.view_state.can_resume = response.resumable
+        if response.is_cancelled:
+            self.view_state.status_text = "Stopped."
+            return
         if not response.is_error:
             self.view_state.status_text = "Done."
             return
@@ -83,18 +132,114 @@ class MainViewModel(BaseViewModel):
             self.emit(AGENT_UPDATE_SOL_SIGNAL, response.message.model_dump_json())
 
     def _on_agent_update_ai(self, _: OrchestratorService, encoded_message: str):
+        # The final message replaces any partial content streamed so far
+        message = ResponseMessage.model_validate_json(encoded_message)
+        self._streaming.pop(message.id, None)
+        self._streaming_dirty.discard(message.id)
         self.emit(AGENT_UPDATE_AI_SIGNAL, encoded_message)
 
+    def _on_agent_update_ai_delta(self, _: OrchestratorService, encoded_delta: str):
+        delta = ResponseDelta.model_validate_json(encoded_delta)
+        if delta.type == DeltaType.RESET:
+            self._streaming[delta.message_id] = {}
+        blocks = self._streaming.setdefault(delta.message_id, {})
+        block = blocks.get(delta.index)
+        if delta.type == DeltaType.TEXT:
+            if not isinstance(block, TextBlockResponse):
+                block = blocks[delta.index] = TextBlockResponse(text="")
+            block.text += delta.text
+        elif delta.type == DeltaType.THINKING:
+            if not isinstance(block, ThinkingBlockResponse):
+                block = blocks[delta.index] = ThinkingBlockResponse(text="")
+            block.text += delta.text
+        elif delta.type in [DeltaType.TOOL_INPUT, DeltaType.TOOL_INPUT_END]:
+            if not isinstance(block, ToolInputResponse):
+                block = blocks[delta.index] = ToolInputResponse(
+                    call_id=delta.call_id or "",
+                    environment=ToolEnvironment.LOCAL,
+                    name=delta.name or "",
+                    arguments={},
+                )
+            if delta.arguments is not None:
+                block.arguments = delta.arguments
+
+        self._streaming_dirty.add(delta.message_id)
+        if self._streaming_source_id is None:
+            self._streaming_source_id = GLib.timeout_add(
+                STREAMING_REFRESH_INTERVAL, self._on_streaming_refresh
+            )
+
+    def _on_streaming_refresh(self) -> bool:
+        self._streaming_source_id = None
+        for message_id in self._streaming_dirty:
+            blocks = self._streaming.get(message_id)
+            if blocks is None:
+                continue
+            message = ResponseMessage(
+                id=message_id,
+                role=MessageRole.AI,
+                content=[blocks[index] for index in sorted(blocks)],
+            )
+            self.emit(AGENT_UPDATE_AI_SIGNAL, message.model_dump_json())
+        self._streaming_dirty.clear()
+        return False
+
+    def _reset_streaming(self):
+        if self._streaming_source_id is not None:
+            GLib.source_remove(self._streaming_source_id)
+            self._streaming_source_id = None
+        self._streaming.clear()
+        self._streaming_dirty.clear()
+
     def _on_agent_update_tool(self, _: OrchestratorService, encoded_message: str):
         self.emit(AGENT_UPDATE_TOOL_SIGNAL, encoded_message)
 
+    def _on_agent_update_status(self, _: OrchestratorService, status: str):
+        self.view_state.status_text = status
+
+    def _on_agent_update_usage(self, _: OrchestratorService, encoded_update: str):
+        update = UsageUpdate.model_validate_json(encoded_update)
+        call, session = update.call, update.session
+
+        # Generation speed, without the wait for the first token
+        parts = []
+        duration = call.latency or 0.0
+        if call.time_to_first_byte is not None:
+            duration -= call.time_to_first_byte
+        if call.usage.output_tokens and duration > 0:
+            parts.append(f"{call.usage.output_tokens / duration:.0f} tokens/s")
+        tokens = session.input_tokens + session.cache_read_tokens
+        tokens += session.cache_write_tokens + session.output_tokens
+        parts.append(f"{tokens:,} tokens")
+        if session.cost > 0:
+            parts.append(f"${session.cost:.3f}")
+        if update.rate_limits is not None:
+            parts.append(update.rate_limits)
+        self.view_state.usage_text = " · ".join(parts)
+
     def run_agent(self, text: str):
         self.view_state.status_text = "Starting agent."
         self._orchestrator.run_agent(text)
 
+    def resume_agent(self):
+        self.view_state.status_text = "Resuming agent."
+        self._orchestrator.resume_agent()
+
+    def stop_agent(self):
+        self.view_state.status_text = "Stopping agent."
+        self._orchestrator.stop_agent()
+
+    @property
+    def messages(self) -> list[BaseMessage]:
+        """Messages of a restored session, to show them again."""
+        return self._orchestrator.messages
+
     def clear(self):
+        self._reset_streaming()
         self._orchestrator.reset_session()
+        self.view_state.can_resume = False
         self.view_state.status_text = "Messages cleared, new session started."
+        self.view_state.usage_text = ""
 
     def shutdown(self):
-        pass
+        self._reset_streaming()
@@ -3,6 +3,7 @@ import logging
 from gi.repository import Adw, Gdk, GLib, GObject, Gtk  # type: ignore
 
 from speedoflight.constants import (
+    AGENT_DISCARD_AI_SIGNAL,
     AGENT_UPDATE_AI_SIGNAL,
     AGENT_UPDATE_SOL_SIGNAL,
     AGENT_UPDATE_TOOL_SIGNAL,
@@ -18,6 +19,7 @@ from speedoflight.models import (
 )
 from speedoflight.ui.chat.chat_widget import ChatWidget
 from speedoflight.ui.input.input_widget import InputWidget
+from speedoflight.ui.main.agent_state import AgentState
 from speedoflight.ui.main.main_view_model import MainViewModel
 from speedoflight.ui.main.main_view_state import MainViewState
 from speedoflight.ui.status.status_widget import StatusWidget
@@ -39,11 +41,15 @@ class MainWindow(Adw.ApplicationWindow):
 
         self._view_model = view_model
         self._view_model.connect(AGENT_UPDATE_AI_SIGNAL, self._on_agent_update_ai)
+        self._view_model.connect(AGENT_DISCARD_AI_SIGNAL, self._on_agent_discard_ai)
         self._view_model.connect(AGENT_UPDATE_SOL_SIGNAL, self._on_agent_update_sol)
         self._view_model.connect(AGENT_UPDATE_TOOL_SIGNAL, self._on_agent_update_tool)
         self._view_model.view_state.connect(
             "notify::status-text", self._on_status_text_changed
         )
+        self._view_model.view_state.connect(
+            "notify::usage-text", self._on_usage_text_changed
+        )
         self._view_model.view_state.connect(
             "notify::agent-state", self._on_agent_state_changed
         )
@@ -53,6 +59,9 @@ class MainWindow(Adw.ApplicationWindow):
         self._view_model.view_state.connect(
             "notify::activity-mode", self._on_activity_mode_changed
         )
+        self._view_model.view_state.connect(
+            "notify::can-resume", self._on_can_resume_changed
+        )
 
         # This style class is typically used to indicate unstable or nightly
         # applications. We use it to signal that computer use is enabled,
@@ -72,6 +81,18 @@ class MainWindow(Adw.ApplicationWindow):
         clear_button.get_style_context().add_class("destructive-action")
         header_bar.pack_end(clear_button)
 
+        # Continues a run that stopped before it was done
+        self._resume_button = Gtk.Button(label="Resume")
+        self._resume_button.connect("clicked", self._on_resume_clicked)
+        self._resume_button.set_visible(self._view_model.view_state.can_resume)
+        header_bar.pack_end(self._resume_button)
+
+        # Cancels the run, including its LLM request and tool calls
+        self._stop_button = Gtk.Button(label="Stop")
+        self._stop_button.connect("clicked", self._on_stop_clicked)
+        self._stop_button.set_visible(False)
+        header_bar.pack_end(self._stop_button)
+
         toolbar_view.add_top_bar(header_bar)
 
         self._chat_widget = ChatWidget()
@@ -94,6 +115,10 @@ class MainWindow(Adw.ApplicationWindow):
 
         toolbar_view.add_bottom_bar(bottom_box)
 
+        # E.g. a restored session
+        for message in self._view_model.messages:
+            self._chat_widget.add_message(GBaseMessage(data=message))
+
     def _load_css(self):
         default_display = Gdk.Display.get_default()
         if default_display:
@@ -109,6 +134,12 @@ class MainWindow(Adw.ApplicationWindow):
         self._chat_widget.clear_messages()
         self._view_model.clear()
 
+    def _on_resume_clicked(self, button):
+        self._view_model.resume_agent()
+
+    def _on_stop_clicked(self, button):
+        self._view_model.stop_agent()
+
     def _on_send_message(self, widget, text):
         human_message = RequestMessage(
             role=MessageRole.HUMAN,
@@ -119,9 +150,13 @@ class MainWindow(Adw.ApplicationWindow):
         self._view_model.run_agent(text)
 
     def _on_agent_update_ai(self, view_model, encoded_message: str):
+        # The same AI message can arrive several times while it is streamed
         ai_message = ResponseMessage.model_validate_json(encoded_message)
         message = GBaseMessage(data=ai_message)
-        self._chat_widget.add_message(message)
+        self._chat_widget.update_message(message)
+
+    def _on_agent_discard_ai(self, view_model, message_id: str):
+        self._chat_widget.remove_message(message_id)
 
     def _on_agent_update_sol(self, view_model, encoded_message: str):
         sol_message = SolMessage.model_validate_json(encoded_message)
@@ -140,12 +175,20 @@ class MainWindow(Adw.ApplicationWindow):
     ):
         self.status_widget.set_status(view_state.status_text)
 
+    def _on_usage_text_changed(
+        self,
+        view_state: MainViewState,
+        param_spec: GObject.ParamSpec,
+    ):
+        self.status_widget.set_usage(view_state.usage_text)
+
     def _on_agent_state_changed(
         self,
         view_state: MainViewState,
         param_spec: GObject.ParamSpec,
     ):
         self._logger.info(f"Agent state changed to: {view_state.agent_state}")
+        self._stop_button.set_visible(view_state.agent_state == AgentState.RUNNING)
 
     def _on_input_enabled_changed(
         self,
@@ -154,6 +197,13 @@ class MainWindow(Adw.ApplicationWindow):
     ):
         self.input_widget.set_enabled(view_state.input_enabled)
 
+    def _on_can_resume_changed(
+        self,
+        view_state: MainViewState,
+        param_spec: GObject.ParamSpec,
+    ):
+        self._resume_button.set_visible(view_state.can_resume)
+
     def _on_activity_mode_changed(
         self,
         view_state: MainViewState,
@@ -19,6 +19,11 @@ class StatusWidget(Gtk.Box):
         self._status_label.set_halign(Gtk.Align.START)
         self.append(self._status_label)
 
+        # Tokens per second of the last response, and totals for the session
+        self._usage_label = Gtk.Label(label="")
+        self._usage_label.add_css_class("dim-label")
+        self.append(self._usage_label)
+
         self._progress_bar = Gtk.ProgressBar()
         self._progress_bar.set_size_request(100, -1)
         self._progress_bar.set_show_text(False)
@@ -27,6 +32,9 @@ class StatusWidget(Gtk.Box):
     def set_status(self, status: str) -> None:
         self._status_label.set_text(status)
 
+    def set_usage(self, usage: str) -> None:
+        self._usage_label.set_text(usage)
+
     def pulse_progress_bar(self) -> bool:
         self._progress_bar.pulse()
         return True